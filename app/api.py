@@ -3,16 +3,25 @@ FastAPI application for SmartMailer
 Provides REST API endpoints for email management
 """
 
+import asyncio
+import os
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Depends, Query
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Dict, Any
+import msgspec
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from loguru import logger
 
 from app.models import Email, ProcessingLog, get_db, create_tables
-from app.database import DatabaseManager
+from app.database import DatabaseManager, LOG_FLUSH_INTERVAL_SECONDS
 from app.config import settings
 from app.notifications import NotificationManager
 
@@ -56,6 +65,75 @@ class ProcessingLogResponse(BaseModel):
         from_attributes = True
 
 
+# msgspec structs for list endpoints: building and encoding these skips the
+# per-row Pydantic validation. The Pydantic models above stay as the
+# response_model so the OpenAPI schema is unchanged.
+class EmailResponseStruct(msgspec.Struct):
+    id: int
+    uid: str
+    subject: str
+    sender: str
+    recipient: str
+    date_received: datetime
+    classification: str
+    auto_reply_sent: bool
+    notification_sent: bool
+    processed_at: datetime
+    created_at: datetime
+
+
+class ProcessingLogResponseStruct(msgspec.Struct):
+    id: int
+    email_id: int
+    action: str
+    status: str
+    message: Optional[str]
+    timestamp: datetime
+
+
+_json_encoder = msgspec.json.Encoder()
+
+
+class MsgspecJSONResponse(JSONResponse):
+    """JSON response rendered with msgspec instead of the stdlib json module"""
+    
+    def render(self, content: Any) -> bytes:
+        return _json_encoder.encode(content)
+
+
+def _to_struct(struct_type, row):
+    """Copy an ORM row's columns into a msgspec struct"""
+    return struct_type(*[getattr(row, field) for field in struct_type.__struct_fields__])
+
+
+def _encode_row(struct_type, row) -> Response:
+    """Encode one ORM row as a JSON object"""
+    return Response(content=_json_encoder.encode(_to_struct(struct_type, row)), media_type="application/json")
+
+
+def _encode_rows(struct_type, rows) -> Response:
+    """Encode ORM rows as a JSON array of msgspec structs"""
+    items = [_to_struct(struct_type, row) for row in rows]
+    return Response(content=_json_encoder.encode(items), media_type="application/json")
+
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _iter_json_array(struct_type, rows: Iterable) -> Iterator[bytes]:
+    """Encode ORM rows as a JSON array incrementally, in chunks of ~64 KiB"""
+    buffer = bytearray(b'[')
+    for index, row in enumerate(rows):
+        if index:
+            buffer += b','
+        buffer += _json_encoder.encode(_to_struct(struct_type, row))
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
 class HealthResponse(BaseModel):
     status: str
     timestamp: datetime
@@ -69,7 +147,8 @@ class HealthResponse(BaseModel):
 app = FastAPI(
     title="SmartMailer API",
     description="API pour l'application intelligente de gestion d'emails",
-    version=settings.app_version
+    version=settings.app_version,
+    default_response_class=MsgspecJSONResponse
 )
 
 # Add CORS middleware
@@ -81,27 +160,104 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON list responses (repeated field names compress well)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Initialize managers
+# Endpoints doing blocking DB/network I/O are plain `def` so FastAPI runs
+# them in its threadpool instead of stalling the event loop.
 db_manager = DatabaseManager()
 notification_manager = NotificationManager()
 
+# Short-lived cache for values polled by /stats and /health, so frequent
+# probes don't hit the database on every request
+RESPONSE_CACHE_TTL_SECONDS = 10
+_response_cache: Dict[str, tuple] = {}
+_response_cache_lock = threading.Lock()
+
+
+def _cached(key: str, compute):
+    """Return the cached value for key, recomputing it once the TTL expires"""
+    now = time.monotonic()
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    
+    value = compute()
+    with _response_cache_lock:
+        _response_cache[key] = (now + RESPONSE_CACHE_TTL_SECONDS, value)
+    return value
+
+
+# Telegram reachability, refreshed in the background so /health never
+# waits on a round trip to api.telegram.org
+TELEGRAM_POLL_INTERVAL_SECONDS = 30
+_telegram_connected = False
+
+# Set by main.run_api() once it has done the one-time startup work for all
+# API processes
+STARTUP_CHECKED_ENV = "SMARTMAILER_STARTUP_CHECKED"
+
+
+async def poll_telegram_connection():
+    """Periodically refresh the cached Telegram connection status"""
+    global _telegram_connected
+    while True:
+        try:
+            _telegram_connected = await asyncio.to_thread(notification_manager.telegram.test_connection)
+        except Exception as e:
+            logger.error(f"Telegram poll error: {e}")
+            _telegram_connected = False
+        await asyncio.sleep(TELEGRAM_POLL_INTERVAL_SECONDS)
+
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize application on startup"""
+    # Background tasks first, so a failing step below cannot leave this
+    # process without them
+    
+    # Bound the delay before buffered processing logs reach the database
+    asyncio.create_task(flush_logs_periodically())
+    
+    # Keep the Telegram status used by /health up to date
+    asyncio.create_task(poll_telegram_connection())
+    
+    # With several API processes, main.run_api() has already created the
+    # tables and tested the connections once
+    if os.environ.get(STARTUP_CHECKED_ENV):
+        return
+    
     try:
         # Create database tables
         create_tables()
         logger.info("Database tables created successfully")
-        
-        # Test connections
-        await test_connections()
-        
     except Exception as e:
         logger.error(f"Startup error: {e}")
+    
+    # Test connections
+    await run_in_threadpool(test_connections)
+
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Write any processing logs still buffered and close outgoing connections"""
+    db_manager.flush_logs()
+    notification_manager.close()
 
-async def test_connections():
+
+async def flush_logs_periodically():
+    """Flush buffered processing logs in the background"""
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(db_manager.flush_logs)
+        except Exception as e:
+            logger.error(f"Log flush error: {e}")
+
+
+def test_connections():
     """Test all external connections"""
     try:
         # Test database
@@ -130,26 +286,23 @@ async def root():
 
 
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+def health_check(db: Session = Depends(get_db)):
     """Health check endpoint"""
     try:
         # Test database
         db_connected = True
         try:
-            db_manager.get_processing_stats()
+            _cached('stats', lambda: db_manager.get_processing_stats(db))
         except:
             db_connected = False
         
-        # Test Telegram
-        telegram_connected = notification_manager.telegram.test_connection()
-        
         return HealthResponse(
             status="healthy" if db_connected else "unhealthy",
             timestamp=datetime.utcnow(),
             version=settings.app_version,
             database_connected=db_connected,
             email_connected=True,  # Will be tested in worker
-            telegram_connected=telegram_connected
+            telegram_connected=_telegram_connected
         )
         
     except Exception as e:
@@ -158,19 +311,26 @@ async def health_check():
 
 
 @app.get("/emails", response_model=List[EmailResponse])
-async def get_emails(
+def get_emails(
     classification: Optional[str] = Query(None, description="Filter by classification"),
-    limit: int = Query(50, ge=1, le=1000, description="Number of emails to return"),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=1000, description="Number of emails to return")
 ):
     """Get emails with optional filtering"""
     try:
-        if classification:
-            emails = db_manager.get_emails_by_classification(classification, limit)
-        else:
-            emails = db_manager.get_recent_emails(limit)
+        # Rows are encoded as they come off the cursor rather than
+        # materialising the whole page first
+        emails = db_manager.stream_emails(classification, limit)
+        
+        # Pull the first row before responding: the query runs here, so its
+        # errors still become a 500 instead of a truncated body after a 200
+        first = next(emails, None)
+        if first is not None:
+            emails = chain([first], emails)
         
-        return [EmailResponse.from_orm(email) for email in emails]
+        return StreamingResponse(
+            _iter_json_array(EmailResponseStruct, emails),
+            media_type="application/json"
+        )
         
     except Exception as e:
         logger.error(f"Error getting emails: {e}")
@@ -178,14 +338,14 @@ async def get_emails(
 
 
 @app.get("/emails/{email_id}", response_model=EmailResponse)
-async def get_email(email_id: int, db: Session = Depends(get_db)):
+def get_email(email_id: int, db: Session = Depends(get_db)):
     """Get specific email by ID"""
     try:
         email = db.query(Email).filter(Email.id == email_id).first()
         if not email:
             raise HTTPException(status_code=404, detail="Email not found")
         
-        return EmailResponse.from_orm(email)
+        return _encode_row(EmailResponseStruct, email)
         
     except HTTPException:
         raise
@@ -195,10 +355,10 @@ async def get_email(email_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/stats", response_model=EmailStats)
-async def get_stats():
+def get_stats(db: Session = Depends(get_db)):
     """Get processing statistics"""
     try:
-        stats = db_manager.get_processing_stats()
+        stats = _cached('stats', lambda: db_manager.get_processing_stats(db))
         return EmailStats(**stats)
         
     except Exception as e:
@@ -207,14 +367,15 @@ async def get_stats():
 
 
 @app.get("/logs", response_model=List[ProcessingLogResponse])
-async def get_logs(
+def get_logs(
     email_id: Optional[int] = Query(None, description="Filter by email ID"),
-    limit: int = Query(100, ge=1, le=1000, description="Number of logs to return")
+    limit: int = Query(100, ge=1, le=1000, description="Number of logs to return"),
+    db: Session = Depends(get_db)
 ):
     """Get processing logs"""
     try:
-        logs = db_manager.get_processing_logs(email_id, limit)
-        return [ProcessingLogResponse.from_orm(log) for log in logs]
+        logs = db_manager.get_processing_logs(email_id, limit, db)
+        return _encode_rows(ProcessingLogResponseStruct, logs)
         
     except Exception as e:
         logger.error(f"Error getting logs: {e}")
@@ -222,7 +383,7 @@ async def get_logs(
 
 
 @app.post("/test/telegram")
-async def test_telegram():
+def test_telegram():
     """Test Telegram notification"""
     try:
         results = notification_manager.test_all_notifications()
@@ -238,7 +399,7 @@ async def test_telegram():
 
 
 @app.post("/emails/{email_id}/resend-notification")
-async def resend_notification(email_id: int, db: Session = Depends(get_db)):
+def resend_notification(email_id: int, db: Session = Depends(get_db)):
     """Resend notification for an email"""
     try:
         email = db.query(Email).filter(Email.id == email_id).first()
@@ -261,7 +422,7 @@ async def resend_notification(email_id: int, db: Session = Depends(get_db)):
         
         if success:
             # Update status
-            db_manager.mark_notification_sent(email_id)
+            db_manager.mark_notification_sent(email_id, db)
             db_manager.log_processing_action(
                 email_id, 'notification_resent', 'success', 'Notification resent via API'
             )
@@ -281,7 +442,7 @@ async def resend_notification(email_id: int, db: Session = Depends(get_db)):
 
 
 @app.delete("/emails/{email_id}")
-async def delete_email(email_id: int, db: Session = Depends(get_db)):
+def delete_email(email_id: int, db: Session = Depends(get_db)):
     """Delete an email (for maintenance)"""
     try:
         email = db.query(Email).filter(Email.id == email_id).first()
@@ -303,12 +464,13 @@ async def delete_email(email_id: int, db: Session = Depends(get_db)):
 
 
 @app.post("/maintenance/cleanup")
-async def cleanup_old_emails(
-    days: int = Query(30, ge=1, le=365, description="Delete emails older than N days")
+def cleanup_old_emails(
+    days: int = Query(30, ge=1, le=365, description="Delete emails older than N days"),
+    db: Session = Depends(get_db)
 ):
     """Clean up old emails"""
     try:
-        count = db_manager.cleanup_old_emails(days)
+        count = db_manager.cleanup_old_emails(days, db)
         return {
             "status": "success",
             "message": f"Cleaned up {count} old emails",
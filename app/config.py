@@ -3,7 +3,7 @@ Configuration management for SmartMailer
 """
 
 import os
-from typing import List, Optional
+from typing import FrozenSet, List, Optional
 from pydantic import validator
 from pydantic_settings import BaseSettings
 
@@ -32,10 +32,12 @@ class Settings(BaseSettings):
     app_version: str = "1.0.0"
     debug: bool = False
     log_level: str = "INFO"
+    api_workers: int = 0  # 0 = one API process per CPU core (ignored in debug)
     
     # Processing Configuration
     check_interval_minutes: int = 5
     max_emails_per_batch: int = 50
+    fetch_batch_size: int = 100
     processing_timeout_seconds: int = 300
     
     # Classification Rules
@@ -50,25 +52,25 @@ class Settings(BaseSettings):
     
     @validator('important_keywords', 'important_senders', 'normal_keywords')
     def parse_comma_separated(cls, v):
-        """Parse comma-separated strings into lists"""
+        """Parse comma-separated strings into frozensets, once at startup"""
         if isinstance(v, str):
-            return [item.strip().lower() for item in v.split(',') if item.strip()]
+            return frozenset(item.strip().lower() for item in v.split(',') if item.strip())
         return v
     
     @property
-    def important_keywords_list(self) -> List[str]:
-        """Get important keywords as list"""
-        return self.important_keywords if isinstance(self.important_keywords, list) else []
+    def important_keywords_list(self) -> FrozenSet[str]:
+        """Get important keywords as a frozenset"""
+        return self.important_keywords if isinstance(self.important_keywords, frozenset) else frozenset()
     
     @property
-    def important_senders_list(self) -> List[str]:
-        """Get important senders as list"""
-        return self.important_senders if isinstance(self.important_senders, list) else []
+    def important_senders_list(self) -> FrozenSet[str]:
+        """Get important senders as a frozenset"""
+        return self.important_senders if isinstance(self.important_senders, frozenset) else frozenset()
     
     @property
-    def normal_keywords_list(self) -> List[str]:
-        """Get normal keywords as list"""
-        return self.normal_keywords if isinstance(self.normal_keywords, list) else []
+    def normal_keywords_list(self) -> FrozenSet[str]:
+        """Get normal keywords as a frozenset"""
+        return self.normal_keywords if isinstance(self.normal_keywords, frozenset) else frozenset()
     
     class Config:
         env_file = ".env"
@@ -3,21 +3,77 @@ Database operations for SmartMailer
 Handles email storage and retrieval
 """
 
-from datetime import datetime
-from typing import List, Optional, Dict
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc
+import threading
+from contextlib import contextmanager
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Dict, Set, Tuple
+from sqlalchemy.orm import Session, selectinload, load_only
+from sqlalchemy import and_, desc, func, case, select, delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from loguru import logger
-from app.models import Email, ProcessingLog, get_db
+from app.models import Email, FetchState, ProcessingLog, SessionLocal, engine, bulk_save_logs
+
+
+def _insert_ignoring_conflicts(model):
+    """Build an INSERT that supports ON CONFLICT DO NOTHING (SQLite or PostgreSQL)"""
+    if engine.dialect.name == 'postgresql':
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+
+@contextmanager
+def _session(db: Optional[Session] = None):
+    """Use the caller's session (e.g. a request's) if given, otherwise a short-lived one"""
+    if db is not None:
+        yield db
+    else:
+        with SessionLocal() as session:
+            yield session
+
+
+def _email_row(email_data: Dict, classification: str) -> Dict:
+    """Map fetched email data to Email column values"""
+    return {
+        'uid': email_data.get('uid'),
+        'subject': email_data.get('subject', ''),
+        'sender': email_data.get('sender', ''),
+        'recipient': email_data.get('recipient', ''),
+        'date_received': email_data.get('date_received', datetime.now()),
+        'content': email_data.get('content', ''),
+        'classification': classification,
+        'auto_reply_sent': False,
+        'notification_sent': False
+    }
+
+
+# Columns loaded for email listings; the potentially large content body is
+# left unloaded (accessing it on a listed email raises once detached)
+EMAIL_LIST_COLUMNS = (
+    Email.id, Email.uid, Email.subject, Email.sender, Email.recipient,
+    Email.date_received, Email.classification, Email.auto_reply_sent,
+    Email.notification_sent, Email.processed_at, Email.created_at
+)
+
+# Processing logs are buffered and written in one INSERT once either limit is reached
+LOG_FLUSH_MAX_ROWS = 200
+LOG_FLUSH_INTERVAL_SECONDS = 0.5
 
 
 class DatabaseManager:
     """Database manager for email operations"""
     
+    # Every query method takes an optional `db` session: API endpoints pass
+    # their request-scoped session, other callers get a short-lived one from
+    # the pooled engine, so concurrent requests and the worker never share one.
+    
     def __init__(self):
-        self.db = next(get_db())
+        self._log_buffer: List[Dict] = []
+        self._log_lock = threading.Lock()
+        self._last_log_flush = time.monotonic()
     
-    def save_email(self, email_data: Dict, classification: str) -> Optional[Email]:
+    def save_email(self, email_data: Dict, classification: str, db: Optional[Session] = None) -> Optional[Email]:
         """
         Save email to database
         
@@ -29,105 +85,197 @@ class DatabaseManager:
             Email object if saved successfully, None otherwise
         """
         try:
-            # Check if email already exists
-            existing_email = self.get_email_by_uid(email_data.get('uid'))
-            if existing_email:
-                logger.warning(f"Email {email_data.get('uid')} already exists in database")
-                return existing_email
-            
-            # Create new email record
-            email_record = Email(
-                uid=email_data.get('uid'),
-                subject=email_data.get('subject', ''),
-                sender=email_data.get('sender', ''),
-                recipient=email_data.get('recipient', ''),
-                date_received=email_data.get('date_received', datetime.now()),
-                content=email_data.get('content', ''),
-                classification=classification,
-                auto_reply_sent=False,
-                notification_sent=False
-            )
+            # Single round trip: insert unless the UID is already stored
+            stmt = _insert_ignoring_conflicts(Email).values(
+                **_email_row(email_data, classification)
+            ).on_conflict_do_nothing(index_elements=['uid']).returning(Email)
             
-            self.db.add(email_record)
-            self.db.commit()
-            self.db.refresh(email_record)
+            with _session(db) as session:
+                email_record = session.scalars(stmt).first()
+                session.commit()
             
-            logger.info(f"Email saved to database: {email_record.id}")
+            if email_record is None:
+                logger.warning(f"Email {email_data.get('uid')} already exists in database")
+                return self.get_email_by_uid(email_data.get('uid'), db)
+            
+            logger.info("Email saved to database: {}", email_record.id)
             return email_record
             
         except Exception as e:
             logger.error(f"Error saving email to database: {e}")
-            self.db.rollback()
             return None
     
-    def get_email_by_uid(self, uid: str) -> Optional[Email]:
+    def save_emails_bulk(self, rows: List[Tuple[Dict, str]], db: Optional[Session] = None) -> Optional[Dict[str, int]]:
+        """
+        Save a batch of emails in one INSERT and one commit
+        
+        Args:
+            rows: (email_data, classification) pairs
+            
+        Returns:
+            Mapping of UID to database ID for the emails actually inserted
+            (UIDs already stored are skipped), or None if the insert failed
+        """
+        if not rows:
+            return {}
+        
+        try:
+            stmt = _insert_ignoring_conflicts(Email).values(
+                [_email_row(email_data, classification) for email_data, classification in rows]
+            ).on_conflict_do_nothing(index_elements=['uid']).returning(Email.id, Email.uid)
+            
+            with _session(db) as session:
+                inserted = {uid: email_id for email_id, uid in session.execute(stmt)}
+                session.commit()
+            
+            logger.info(f"Saved {len(inserted)}/{len(rows)} emails to database")
+            return inserted
+            
+        except Exception as e:
+            logger.error(f"Error bulk saving emails to database: {e}")
+            return None
+    
+    def get_email_by_uid(self, uid: str, db: Optional[Session] = None) -> Optional[Email]:
         """Get email by UID"""
         try:
-            return self.db.query(Email).filter(Email.uid == uid).first()
+            with _session(db) as session:
+                return session.query(Email).filter(Email.uid == uid).first()
         except Exception as e:
             logger.error(f"Error getting email by UID: {e}")
             return None
     
-    def get_emails_by_classification(self, classification: str, limit: int = 100) -> List[Email]:
-        """Get emails by classification"""
+    def get_recent_uids(self, days: int = 2, db: Optional[Session] = None) -> Set[str]:
+        """Get the UIDs of emails received in the last N days"""
         try:
-            return self.db.query(Email).filter(
-                Email.classification == classification
-            ).order_by(desc(Email.date_received)).limit(limit).all()
+            since = datetime.now() - timedelta(days=days)
+            with _session(db) as session:
+                return set(session.scalars(select(Email.uid).where(Email.date_received >= since)))
+        except Exception as e:
+            logger.error(f"Error getting recent UIDs: {e}")
+            return set()
+    
+    def get_existing_uids(self, uids: List[str], db: Optional[Session] = None) -> Set[str]:
+        """Get which of the given UIDs are already stored, in one query"""
+        if not uids:
+            return set()
+        
+        try:
+            with _session(db) as session:
+                return set(session.scalars(select(Email.uid).where(Email.uid.in_(uids))))
+        except Exception as e:
+            logger.error(f"Error checking existing UIDs: {e}")
+            return set()
+    
+    def get_emails_by_classification(self, classification: str, limit: int = 100, db: Optional[Session] = None) -> List[Email]:
+        """Get emails by classification (without content)"""
+        try:
+            with _session(db) as session:
+                return session.query(Email).options(load_only(*EMAIL_LIST_COLUMNS)).filter(
+                    Email.classification == classification
+                ).order_by(desc(Email.date_received)).limit(limit).all()
         except Exception as e:
             logger.error(f"Error getting emails by classification: {e}")
             return []
     
-    def get_recent_emails(self, limit: int = 50) -> List[Email]:
-        """Get recent emails"""
+    def get_recent_emails(self, limit: int = 50, db: Optional[Session] = None) -> List[Email]:
+        """Get recent emails (without content)"""
         try:
-            return self.db.query(Email).order_by(
-                desc(Email.date_received)
-            ).limit(limit).all()
+            with _session(db) as session:
+                return session.query(Email).options(load_only(*EMAIL_LIST_COLUMNS)).order_by(
+                    desc(Email.date_received)
+                ).limit(limit).all()
         except Exception as e:
             logger.error(f"Error getting recent emails: {e}")
             return []
     
-    def update_email_status(self, email_id: int, **kwargs) -> bool:
+    def stream_emails(self, classification: Optional[str] = None, limit: int = 50,
+                      batch_size: int = 100) -> Iterator[Email]:
+        """
+        Stream emails newest first (without content) through a server-side cursor
+        
+        Rows are fetched batch_size at a time on a session owned by the
+        iterator, so it can outlive the caller's request scope.
+        """
+        stmt = select(Email).options(load_only(*EMAIL_LIST_COLUMNS))
+        if classification:
+            stmt = stmt.where(Email.classification == classification)
+        stmt = stmt.order_by(desc(Email.date_received)).limit(limit).execution_options(
+            yield_per=batch_size
+        )
+        
+        with SessionLocal() as db:
+            yield from db.scalars(stmt)
+    
+    def update_email_status(self, email_id: int, db: Optional[Session] = None, **kwargs) -> bool:
         """Update email status"""
         try:
-            email = self.db.query(Email).filter(Email.id == email_id).first()
-            if not email:
-                logger.error(f"Email with ID {email_id} not found")
-                return False
-            
-            # Update fields
-            for key, value in kwargs.items():
-                if hasattr(email, key):
-                    setattr(email, key, value)
+            with _session(db) as session:
+                email = session.query(Email).filter(Email.id == email_id).first()
+                if not email:
+                    logger.error(f"Email with ID {email_id} not found")
+                    return False
+                
+                # Update fields
+                for key, value in kwargs.items():
+                    if hasattr(email, key):
+                        setattr(email, key, value)
+                
+                email.updated_at = datetime.utcnow()
+                session.commit()
             
-            email.updated_at = datetime.utcnow()
-            self.db.commit()
-            
-            logger.info(f"Email {email_id} status updated")
+            logger.info("Email {} status updated", email_id)
             return True
             
         except Exception as e:
             logger.error(f"Error updating email status: {e}")
-            self.db.rollback()
             return False
     
-    def mark_auto_reply_sent(self, email_id: int) -> bool:
+    def update_emails_status(self, email_ids: List[int], db: Optional[Session] = None, **kwargs) -> int:
+        """Update the same fields on several emails in one UPDATE; returns rows updated"""
+        if not email_ids:
+            return 0
+        
+        try:
+            stmt = update(Email).where(Email.id.in_(email_ids)).values(updated_at=datetime.utcnow(), **kwargs)
+            
+            with _session(db) as session:
+                updated = session.execute(stmt).rowcount
+                session.commit()
+            
+            logger.info(f"{updated} email statuses updated")
+            return updated
+            
+        except Exception as e:
+            logger.error(f"Error updating email statuses: {e}")
+            return 0
+    
+    def mark_auto_reply_sent(self, email_id: int, db: Optional[Session] = None) -> bool:
         """Mark email as having auto-reply sent"""
-        return self.update_email_status(email_id, auto_reply_sent=True)
+        return self.update_email_status(email_id, db, auto_reply_sent=True)
     
-    def mark_notification_sent(self, email_id: int) -> bool:
+    def mark_notification_sent(self, email_id: int, db: Optional[Session] = None) -> bool:
         """Mark email as having notification sent"""
-        return self.update_email_status(email_id, notification_sent=True)
+        return self.update_email_status(email_id, db, notification_sent=True)
     
-    def get_processing_stats(self) -> Dict:
+    def get_processing_stats(self, db: Optional[Session] = None) -> Dict:
         """Get processing statistics"""
         try:
-            total_emails = self.db.query(Email).count()
-            normal_emails = self.db.query(Email).filter(Email.classification == 'normal').count()
-            important_emails = self.db.query(Email).filter(Email.classification == 'important').count()
-            auto_replies_sent = self.db.query(Email).filter(Email.auto_reply_sent == True).count()
-            notifications_sent = self.db.query(Email).filter(Email.notification_sent == True).count()
+            # One scan with conditional aggregates instead of five COUNT queries
+            stmt = select(
+                func.count(Email.id),
+                func.sum(case((Email.classification == 'normal', 1), else_=0)),
+                func.sum(case((Email.classification == 'important', 1), else_=0)),
+                func.sum(case((Email.auto_reply_sent == True, 1), else_=0)),
+                func.sum(case((Email.notification_sent == True, 1), else_=0))
+            )
+            
+            with _session(db) as session:
+                row = session.execute(stmt).one()
+            
+            # SUM() is NULL on an empty table
+            total_emails, normal_emails, important_emails, auto_replies_sent, notifications_sent = (
+                value or 0 for value in row
+            )
             
             return {
                 'total_emails': total_emails,
@@ -143,65 +291,118 @@ class DatabaseManager:
             return {}
     
     def log_processing_action(self, email_id: int, action: str, status: str, message: str = "") -> bool:
-        """Log processing action"""
+        """Log processing action (buffered; see flush_logs)"""
         try:
-            log_entry = ProcessingLog(
-                email_id=email_id,
-                action=action,
-                status=status,
-                message=message
-            )
+            with self._log_lock:
+                self._log_buffer.append({
+                    'email_id': email_id,
+                    'action': action,
+                    'status': status,
+                    'message': message,
+                    'timestamp': datetime.utcnow()
+                })
+                flush_due = (
+                    len(self._log_buffer) >= LOG_FLUSH_MAX_ROWS
+                    or time.monotonic() - self._last_log_flush >= LOG_FLUSH_INTERVAL_SECONDS
+                )
             
-            self.db.add(log_entry)
-            self.db.commit()
+            if flush_due:
+                self.flush_logs()
             
             return True
             
         except Exception as e:
             logger.error(f"Error logging processing action: {e}")
-            self.db.rollback()
             return False
     
-    def get_processing_logs(self, email_id: Optional[int] = None, limit: int = 100) -> List[ProcessingLog]:
-        """Get processing logs"""
+    def flush_logs(self) -> int:
+        """Write buffered processing logs in batched INSERTs; returns rows written"""
+        with self._log_lock:
+            rows, self._log_buffer = self._log_buffer, []
+            self._last_log_flush = time.monotonic()
+        
+        if not rows:
+            return 0
+        
         try:
-            query = self.db.query(ProcessingLog)
+            with SessionLocal() as db:
+                return bulk_save_logs(db, rows)
             
-            if email_id:
-                query = query.filter(ProcessingLog.email_id == email_id)
+        except Exception as e:
+            logger.error(f"Error flushing {len(rows)} processing logs: {e}")
+            return 0
+    
+    def get_processing_logs(self, email_id: Optional[int] = None, limit: int = 100, db: Optional[Session] = None) -> List[ProcessingLog]:
+        """Get processing logs"""
+        try:
+            self.flush_logs()
             
-            return query.order_by(desc(ProcessingLog.timestamp)).limit(limit).all()
+            with _session(db) as session:
+                # Load the related emails in one extra query so log.email stays
+                # usable once the session is closed, without a query per row
+                query = session.query(ProcessingLog).options(
+                    selectinload(ProcessingLog.email).defer(Email.content)
+                )
+                
+                if email_id:
+                    query = query.filter(ProcessingLog.email_id == email_id)
+                
+                return query.order_by(desc(ProcessingLog.timestamp)).limit(limit).all()
             
         except Exception as e:
             logger.error(f"Error getting processing logs: {e}")
             return []
     
-    def cleanup_old_emails(self, days: int = 30) -> int:
+    def cleanup_old_emails(self, days: int = 30, db: Optional[Session] = None) -> int:
         """Clean up old emails (for maintenance)"""
         try:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            # Count emails to be deleted
-            count = self.db.query(Email).filter(
-                Email.date_received < cutoff_date
-            ).count()
-            
-            # Delete old emails
-            self.db.query(Email).filter(
-                Email.date_received < cutoff_date
-            ).delete()
-            
-            self.db.commit()
+            with _session(db) as session:
+                # Logs first: nothing cascades the bulk DELETE to them on SQLite
+                old_ids = select(Email.id).where(Email.date_received < cutoff_date)
+                session.execute(
+                    delete(ProcessingLog).where(ProcessingLog.email_id.in_(old_ids)),
+                    execution_options={'synchronize_session': False}
+                )
+                
+                # Single DELETE; the affected row count is the number removed
+                result = session.execute(
+                    delete(Email).where(Email.date_received < cutoff_date),
+                    execution_options={'synchronize_session': False}
+                )
+                count = result.rowcount
+                session.commit()
             
             logger.info(f"Cleaned up {count} old emails")
             return count
             
         except Exception as e:
             logger.error(f"Error cleaning up old emails: {e}")
-            self.db.rollback()
             return 0
     
+    def get_fetch_state(self, folder: str, db: Optional[Session] = None) -> Optional[Tuple[Optional[int], int]]:
+        """Get (UIDVALIDITY, last seen UID) stored for a folder"""
+        try:
+            with _session(db) as session:
+                state = session.get(FetchState, folder)
+                return (state.uid_validity, state.last_seen_uid) if state else None
+        except Exception as e:
+            logger.error(f"Error getting fetch state for {folder}: {e}")
+            return None
+    
+    def save_fetch_state(self, folder: str, uid_validity: Optional[int], last_seen_uid: int,
+                         db: Optional[Session] = None) -> bool:
+        """Store the last UID processed in a folder"""
+        try:
+            with _session(db) as session:
+                session.merge(FetchState(folder=folder, uid_validity=uid_validity, last_seen_uid=last_seen_uid))
+                session.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving fetch state for {folder}: {e}")
+            return False
+    
     def close(self):
-        """Close database connection"""
-        if self.db:
-            self.db.close()
+        """Flush pending logs (sessions are already released per call)"""
+        self.flush_logs()
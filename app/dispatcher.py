@@ -0,0 +1,44 @@
+"""
+Background dispatch for SmartMailer
+Runs network-bound work (SMTP replies, Telegram notifications) off the polling thread
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from loguru import logger
+
+
+# Concurrency per external service. Each service gets its own pool so a burst
+# of notifications cannot hold up auto-replies (or the reverse). SMTP sends are
+# serialised on the sender's session anyway, so one thread is enough there.
+DISPATCH_LANES: Dict[str, int] = {
+    'smtp': 1,
+    'telegram': 4,
+}
+
+
+class Dispatcher:
+    """Thread pools for fire-and-forget side effects of email processing"""
+
+    def __init__(self, lanes: Optional[Dict[str, int]] = None):
+        self._executors = {
+            lane: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"smartmailer-{lane}")
+            for lane, workers in (lanes or DISPATCH_LANES).items()
+        }
+
+    def submit(self, lane: str, fn: Callable, *args, **kwargs) -> Future:
+        """Schedule fn(*args, **kwargs) on a background thread of the given lane"""
+        future = self._executors[lane].submit(fn, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future: Future):
+        """Surface exceptions that would otherwise be lost with the future"""
+        if not future.cancelled() and future.exception():
+            logger.error(f"Background task failed: {future.exception()}")
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work, optionally waiting for queued tasks"""
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
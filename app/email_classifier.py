@@ -4,11 +4,81 @@ Classifies emails as 'normal' or 'important' based on rules
 """
 
 import re
-from typing import Dict, List
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Dict, FrozenSet, Iterable, List, Optional, Pattern
 from loguru import logger
 from app.config import settings
 
 
+# Distinct (sender, subject) pairs whose header verdict is remembered
+HEADER_CACHE_SIZE = 4096
+
+# Distinct message fingerprints whose classification is remembered
+VERDICT_CACHE_SIZE = 4096
+
+# The rules never look further into the body than this
+CONTENT_SCAN_CHARS = 500
+
+
+# Known sender domains used as a fallback when no rule matches
+IMPORTANT_DOMAINS = [
+    'company.com',
+    'entreprise.fr',
+    'hr.com',
+    'recruitment.com'
+]
+
+NORMAL_DOMAINS = [
+    'newsletter.com',
+    'marketing.com',
+    'promo.com',
+    'ads.com',
+    'noreply.com',
+    'no-reply.com'
+]
+
+
+@lru_cache(maxsize=32)
+def _compile_literals(literals: FrozenSet[str]) -> Optional[Pattern]:
+    """Compile substrings into one alternation matched in a single scan"""
+    literals = [literal for literal in literals if literal]
+    if not literals:
+        return None
+    # Longest first so the reported match is the most specific literal
+    ordered = sorted(literals, key=lambda literal: (-len(literal), literal))
+    return re.compile('|'.join(re.escape(literal) for literal in ordered))
+
+
+def _literal_matcher(literals: Iterable[str]) -> Optional[Pattern]:
+    """Get the compiled matcher for a rule list, shared by identical lists"""
+    return _compile_literals(frozenset(literals))
+
+
+def _rule_matcher(literals: Iterable[str], pattern: str) -> Pattern:
+    """Combine a keyword list and a word pattern so one scan finds either"""
+    alternatives = [f'(?P<pattern>{pattern})']
+    literal_re = _literal_matcher(literals)
+    if literal_re:
+        alternatives.insert(0, f'(?P<keyword>{literal_re.pattern})')
+    return re.compile('|'.join(alternatives))
+
+
+_important_domain_re = _literal_matcher(IMPORTANT_DOMAINS)
+_normal_domain_re = _literal_matcher(NORMAL_DOMAINS)
+
+# Built-in word patterns, matched case-insensitively next to the configured keywords
+URGENT_PATTERN = (
+    r'(?i:\b(?:urgent|asap|as soon as possible|deadline|due date|entretien|interview'
+    r'|recrutement|recruitment|hiring|rh|hr|human resources)\b)'
+)
+NORMAL_PATTERN = (
+    r'(?i:\b(?:newsletter|news letter|marketing|promotion|promo|publicité|advertisement|ads'
+    r'|unsubscribe|désabonnement|offre|offer|deal)\b)'
+)
+
+
 class EmailClassifier:
     """Email classifier based on rules and keywords"""
     
@@ -16,6 +86,37 @@ class EmailClassifier:
         self.important_keywords = settings.important_keywords_list
         self.important_senders = settings.important_senders_list
         self.normal_keywords = settings.normal_keywords_list
+        self._build_matchers()
+    
+    def _build_matchers(self):
+        """Compile keyword and sender lists into single-pass matchers"""
+        self._important_sender_re = _literal_matcher(self.important_senders)
+        
+        # Keywords and the built-in pattern of a category share one regex,
+        # so each text is scanned once per category
+        self._important_re = _rule_matcher(self.important_keywords, URGENT_PATTERN)
+        self._normal_re = _rule_matcher(self.normal_keywords, NORMAL_PATTERN)
+        
+        # Newsletters and repeat senders reuse the same sender and subject;
+        # a fresh cache per rule set keeps verdicts consistent with the rules
+        self._header_match = lru_cache(maxsize=HEADER_CACHE_SIZE)(self._match_headers)
+        
+        # Duplicate messages (same sender, subject and scanned body) reuse the
+        # full verdict; only used from the worker thread
+        self._verdicts: "OrderedDict[bytes, str]" = OrderedDict()
+    
+    def _match_headers(self, sender: str, subject: str) -> Optional[str]:
+        """Describe the important rule matched by sender or subject alone, if any"""
+        if self._important_sender_re:
+            match = self._important_sender_re.search(sender)
+            if match:
+                return f"Important sender match: {match.group(0)}"
+        
+        match = self._important_re.search(subject)
+        if match:
+            return f"Important {match.lastgroup} in subject: {match.group(0)}"
+        
+        return None
     
     def classify_email(self, email_data: Dict) -> str:
         """
@@ -30,88 +131,88 @@ class EmailClassifier:
         try:
             subject = email_data.get('subject', '').lower()
             sender = email_data.get('sender', '').lower()
-            content = email_data.get('content', '').lower()
-            
-            # Check if email is important
-            if self._is_important_email(subject, sender, content):
-                logger.info(f"Email classified as IMPORTANT: {subject[:50]}...")
-                return 'important'
-            
-            # Check if email is normal
-            elif self._is_normal_email(subject, sender, content):
-                logger.info(f"Email classified as NORMAL: {subject[:50]}...")
-                return 'normal'
+            content = email_data.get('content', '').lower()[:CONTENT_SCAN_CHARS]
             
-            # Default classification based on sender domain
-            else:
-                classification = self._classify_by_sender_domain(sender)
-                logger.info(f"Email classified as {classification.upper()} (by domain): {subject[:50]}...")
+            # Everything the rules read, hashed: identical inputs, identical verdict
+            fingerprint = blake2b(
+                '\0'.join((subject, sender, content)).encode('utf-8', 'surrogatepass'),
+                digest_size=16
+            ).digest()
+            classification = self._verdicts.get(fingerprint)
+            if classification:
+                self._verdicts.move_to_end(fingerprint)
+                logger.info("Email classified as {} (cached): {:.50}...", classification.upper(), subject)
                 return classification
+            
+            classification = self._classify(subject, sender, content)
+            self._verdicts[fingerprint] = classification
+            if len(self._verdicts) > VERDICT_CACHE_SIZE:
+                self._verdicts.popitem(last=False)
+            return classification
                 
         except Exception as e:
             logger.error(f"Error classifying email: {e}")
             return 'normal'  # Default to normal on error
     
-    def _is_important_email(self, subject: str, sender: str, content: str) -> bool:
-        """Check if email should be classified as important"""
+    def _classify(self, subject: str, sender: str, content: str) -> str:
+        """Apply the rules to lowercased subject, sender and content"""
+        # Check if email is important
+        if self._is_important_email(subject, sender, content):
+            logger.info("Email classified as IMPORTANT: {:.50}...", subject)
+            return 'important'
         
-        # Check important senders
-        for important_sender in self.important_senders:
-            if important_sender in sender:
-                logger.debug(f"Important sender match: {important_sender}")
-                return True
+        # Check if email is normal
+        if self._is_normal_email(subject, sender, content):
+            logger.info("Email classified as NORMAL: {:.50}...", subject)
+            return 'normal'
         
-        # Check important keywords in subject
-        for keyword in self.important_keywords:
-            if keyword in subject:
-                logger.debug(f"Important keyword in subject: {keyword}")
-                return True
+        # Default classification based on sender domain
+        classification = self._classify_by_sender_domain(sender)
+        logger.info("Email classified as {} (by domain): {:.50}...", classification.upper(), subject)
+        return classification
+    
+    def classify_batch(self, emails: List[Dict]) -> List[str]:
+        """
+        Classify a batch of emails
         
-        # Check important keywords in content (first 500 chars)
-        content_preview = content[:500]
-        for keyword in self.important_keywords:
-            if keyword in content_preview:
-                logger.debug(f"Important keyword in content: {keyword}")
-                return True
+        Args:
+            emails: List of email data dictionaries
+            
+        Returns:
+            List[str]: 'normal' or 'important' for each email, in input order
+        """
+        classifications = [self.classify_email(email_data) for email_data in emails]
+        
+        important_count = classifications.count('important')
+        logger.info(f"Batch classified: {important_count} important, "
+                    f"{len(classifications) - important_count} normal")
+        return classifications
+    
+    def _is_important_email(self, subject: str, sender: str, content: str) -> bool:
+        """Check if email should be classified as important"""
         
-        # Check for urgent patterns
-        urgent_patterns = [
-            r'\b(urgent|asap|as soon as possible)\b',
-            r'\b(deadline|due date)\b',
-            r'\b(entretien|interview)\b',
-            r'\b(recrutement|recruitment|hiring)\b',
-            r'\b(rh|hr|human resources)\b'
-        ]
+        # Check important senders and subject (cached per sender/subject pair)
+        header_match = self._header_match(sender, subject)
+        if header_match:
+            logger.debug(header_match)
+            return True
         
-        for pattern in urgent_patterns:
-            if re.search(pattern, subject + ' ' + content_preview, re.IGNORECASE):
-                logger.debug(f"Urgent pattern match: {pattern}")
-                return True
+        # Check important keywords and urgent patterns (content: first 500 chars)
+        match = self._important_re.search(subject + ' ' + content[:CONTENT_SCAN_CHARS])
+        if match:
+            logger.debug("Important {} match: {}", match.lastgroup, match.group(0))
+            return True
         
         return False
     
     def _is_normal_email(self, subject: str, sender: str, content: str) -> bool:
         """Check if email should be classified as normal"""
         
-        # Check normal keywords
-        for keyword in self.normal_keywords:
-            if keyword in subject or keyword in content[:200]:
-                logger.debug(f"Normal keyword match: {keyword}")
-                return True
-        
-        # Check for newsletter/marketing patterns
-        normal_patterns = [
-            r'\b(newsletter|news letter)\b',
-            r'\b(marketing|promotion|promo)\b',
-            r'\b(publicité|advertisement|ads)\b',
-            r'\b(unsubscribe|désabonnement)\b',
-            r'\b(offre|offer|deal)\b'
-        ]
-        
-        for pattern in normal_patterns:
-            if re.search(pattern, subject + ' ' + content[:200], re.IGNORECASE):
-                logger.debug(f"Normal pattern match: {pattern}")
-                return True
+        # Check normal keywords and newsletter/marketing patterns
+        match = self._normal_re.search(subject + ' ' + content[:200])
+        if match:
+            logger.debug("Normal {} match: {}", match.lastgroup, match.group(0))
+            return True
         
         return False
     
@@ -122,31 +223,11 @@ class EmailClassifier:
             if '@' in sender:
                 domain = sender.split('@')[1].lower()
                 
-                # Known important domains
-                important_domains = [
-                    'company.com',
-                    'entreprise.fr',
-                    'hr.com',
-                    'recruitment.com'
-                ]
-                
-                # Known normal domains
-                normal_domains = [
-                    'newsletter.com',
-                    'marketing.com',
-                    'promo.com',
-                    'ads.com',
-                    'noreply.com',
-                    'no-reply.com'
-                ]
-                
-                for imp_domain in important_domains:
-                    if imp_domain in domain:
-                        return 'important'
+                if _important_domain_re.search(domain):
+                    return 'important'
                 
-                for norm_domain in normal_domains:
-                    if norm_domain in domain:
-                        return 'normal'
+                if _normal_domain_re.search(domain):
+                    return 'normal'
             
             # Default classification
             return 'normal'
@@ -173,6 +254,7 @@ class EmailClassifier:
             if 'normal_keywords' in rules:
                 self.normal_keywords = rules['normal_keywords']
             
+            self._build_matchers()
             logger.info("Classification rules updated")
             
         except Exception as e:
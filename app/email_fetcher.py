@@ -3,49 +3,217 @@ Email fetching module for SmartMailer
 Supports Gmail and Outlook via IMAP
 """
 
+import binascii
+import codecs
 import email
+import email.policy
+import email.utils
+import io
 import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from email.parser import BytesHeaderParser
+from functools import lru_cache
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientError
 from loguru import logger
 from app.config import settings
 
 
+class _ResumingSSLContext(ssl.SSLContext):
+    """TLS context that offers a host's previous session when reconnecting"""
+    
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT):
+        self.sessions: Dict[str, ssl.SSLSession] = {}
+    
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+
+
+# Loading the CA bundle is expensive: build the TLS context once per process.
+# Reconnects resume the previous TLS session instead of a full handshake.
+_SSL_CTX = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+_SSL_CTX.load_default_certs()
+_SSL_CTX.options |= ssl.OP_NO_COMPRESSION
+
+# Servers drop idle IMAP sessions after ~30 minutes; NOOP before that
+IMAP_KEEPALIVE_SECONDS = 25 * 60
+
+# RFC 2177: re-issue IDLE before the server's 30-minute inactivity timeout
+IDLE_TIMEOUT_SECONDS = 29 * 60
+
+# How often an IDLE wait wakes up to check whether it should stop
+IDLE_CHECK_SECONDS = 5
+
+# Untagged responses that mean new mail arrived during IDLE
+_NEW_MAIL_RESPONSES = (b'EXISTS', b'RECENT')
+
+# Messages are fetched in two steps: headers and MIME structure first, then
+# only the first text/plain section, so attachments never cross the wire
+HEADER_FETCH_ITEMS = ['BODY.PEEK[HEADER]', 'BODYSTRUCTURE', 'INTERNALDATE']
+
+FOLDER = 'INBOX'
+
+# Only the first text/plain part is decoded, and only up to this size
+MAX_CONTENT_BYTES = 64 * 1024
+
+# Partial fetch size for the text section; leaves room for transfer encoding
+TEXT_FETCH_BYTES = 128 * 1024
+
+# Text payloads are decoded in slices of this size
+PARSE_CHUNK_BYTES = 64 * 1024
+
+
+def _iter_chunks(data: bytes, size: int) -> Iterator[bytes]:
+    """Yield successive slices of data"""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@lru_cache(maxsize=1024)
+def _parse_date_cached(date_str: str) -> datetime:
+    """Parse an RFC 2822 Date header (memoized; batches repeat the same values)"""
+    return email.utils.parsedate_to_datetime(date_str)
+
+
+def _find_text_section(structure) -> Optional[Tuple[str, bytes, Optional[str]]]:
+    """
+    Depth-first search of a BODYSTRUCTURE for the first text/plain part
+    
+    Returns:
+        (section number, transfer encoding, charset), or None if there is no text part
+    """
+    if not structure:
+        return None
+    
+    # A single-part message is section 1, whatever text subtype it is
+    if not isinstance(structure[0], list):
+        if structure[0].lower() != b'text':
+            return None
+        return ('1',) + _text_part_encoding(structure)
+    
+    stack = [(structure, ())]
+    while stack:
+        part, path = stack.pop()
+        if isinstance(part[0], list):
+            # Multipart: (children, subtype, ...); children are numbered from 1
+            stack.extend(reversed([(child, path + (index,)) for index, child in enumerate(part[0], 1)]))
+        elif (part[0].lower(), part[1].lower()) == (b'text', b'plain'):
+            return ('.'.join(map(str, path)),) + _text_part_encoding(part)
+    return None
+
+
+def _text_part_encoding(part) -> Tuple[bytes, Optional[str]]:
+    """Transfer encoding and charset of a single-part BODYSTRUCTURE entry"""
+    params = part[2] or ()
+    charset = dict(zip(
+        (key.lower() for key in params[::2]), params[1::2]
+    )).get(b'charset')
+    return (part[5] or b'7bit').lower(), charset.decode('ascii', 'ignore') if charset else None
+
+
+def _decode_transfer(body: bytes, encoding: bytes) -> bytes:
+    """Undo the Content-Transfer-Encoding of a (possibly truncated) section"""
+    if encoding == b'base64':
+        data = b''.join(body.split())
+        return binascii.a2b_base64(data[:len(data) - len(data) % 4])
+    if encoding == b'quoted-printable':
+        return binascii.a2b_qp(body)
+    return body
+
+
+@lru_cache(maxsize=64)
+def _text_codec(charset: Optional[str]) -> codecs.CodecInfo:
+    """Codec for a part's declared charset, falling back to UTF-8"""
+    try:
+        return codecs.lookup(charset or 'utf-8')
+    except LookupError:
+        return codecs.lookup('utf-8')
+
+
+def _decode_text(payload: bytes, charset: Optional[str]) -> str:
+    """Decode a text payload chunk by chunk, stopping at MAX_CONTENT_BYTES characters"""
+    decoder = _text_codec(charset).incrementaldecoder(errors='ignore')
+    out = io.StringIO()
+    size = 0
+    for chunk in _iter_chunks(payload, PARSE_CHUNK_BYTES):
+        size += out.write(decoder.decode(chunk))
+        if size >= MAX_CONTENT_BYTES:
+            break
+    else:
+        out.write(decoder.decode(b'', final=True))
+    return out.getvalue()[:MAX_CONTENT_BYTES]
+
+
+def _section_data(msg_data: Dict, section: str) -> Optional[bytes]:
+    """Body of a fetched section; servers echo partial fetches as BODY[n]<0>"""
+    prefix = f'BODY[{section}]'.encode()
+    for key, value in msg_data.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+
 class EmailFetcher:
     """Email fetcher for Gmail and Outlook"""
     
+    # One long-lived IMAP session per fetcher: it is only reopened when the
+    # server drops it, instead of paying TLS + LOGIN on every poll.
+    
     def __init__(self):
         self.client: Optional[IMAPClient] = None
         self.connected = False
+        self._keepalive_at = 0.0
+        self.last_error: Optional[Exception] = None  # why the last connect() failed
+        
+        # Incremental polling: only UIDs above last_seen_uid are fetched.
+        # UIDs are only comparable while the folder's UIDVALIDITY is unchanged.
+        self.uid_validity: Optional[int] = None
+        self.last_seen_uid: Optional[int] = None
     
     def connect(self) -> bool:
         """Connect to email server"""
         try:
-            # Create SSL context
-            ssl_context = ssl.create_default_context()
-            
             # Connect to IMAP server
             self.client = IMAPClient(
                 settings.email_imap_server,
                 port=settings.email_imap_port,
                 ssl=True,
-                ssl_context=ssl_context
+                ssl_context=_SSL_CTX
             )
             
             # Login
             self.client.login(settings.email_address, settings.email_password)
-            self.client.select_folder('INBOX')
+            self._remember_tls_session()
+            
+            folder_info = self.client.select_folder(FOLDER)
+            self._check_uid_validity(folder_info.get(b'UIDVALIDITY'))
             
             self.connected = True
+            self._keepalive_at = time.monotonic()
+            self.last_error = None
             logger.info(f"Connected to {settings.email_provider} email server")
             return True
             
         except Exception as e:
             logger.error(f"Failed to connect to email server: {e}")
             self.connected = False
+            self.last_error = e
             return False
     
+    def _remember_tls_session(self):
+        """Keep the TLS session (tickets arrive by the end of LOGIN) for the next connect"""
+        sock = self.client.socket()
+        if getattr(sock, 'session_reused', False):
+            logger.debug("Resumed previous TLS session")
+        session = getattr(sock, 'session', None)
+        if session is not None:
+            _SSL_CTX.sessions[settings.email_imap_server] = session
+    
     def disconnect(self):
         """Disconnect from email server"""
         if self.client and self.connected:
@@ -56,84 +224,244 @@ class EmailFetcher:
             except Exception as e:
                 logger.error(f"Error disconnecting: {e}")
     
-    def fetch_new_emails(self, since_days: int = 1) -> List[Dict]:
-        """Fetch new emails from the last N days"""
+    def restore_state(self, uid_validity: Optional[int], last_seen_uid: Optional[int]):
+        """Resume incremental polling from a previously saved position"""
+        self.uid_validity = uid_validity
+        self.last_seen_uid = last_seen_uid
+    
+    def _check_uid_validity(self, uid_validity: Optional[int]):
+        """Forget the last seen UID if the server renumbered the folder"""
+        if uid_validity is None:
+            return
+        if self.uid_validity is not None and uid_validity != self.uid_validity:
+            logger.warning(f"UIDVALIDITY of {FOLDER} changed, rescanning recent emails")
+            self.last_seen_uid = None
+        self.uid_validity = uid_validity
+    
+    def _search_new_uids(self, since_days: int) -> List[int]:
+        """UIDs to fetch: everything above the last seen UID, or a recent window on first run"""
+        if self.last_seen_uid is None:
+            since_date = datetime.now() - timedelta(days=since_days)
+            messages = self._run('search', ['SINCE', since_date.strftime('%d-%b-%Y')])
+            
+            # Limit the initial scan to max emails per batch
+            return sorted(messages)[-settings.max_emails_per_batch:]
+        
+        # "n:*" always matches the highest UID, even when it is below n
+        messages = self._run('search', ['UID', f'{self.last_seen_uid + 1}:*'])
+        return sorted(uid for uid in messages if uid > self.last_seen_uid)
+    
+    def _ensure_alive(self) -> bool:
+        """Reuse the open connection, probing it with NOOP once it has been idle"""
         if not self.connected:
-            if not self.connect():
-                return []
+            return self.connect()
         
+        if time.monotonic() - self._keepalive_at > IMAP_KEEPALIVE_SECONDS:
+            try:
+                self.client.noop()
+                self._keepalive_at = time.monotonic()
+            except (IMAPClientError, OSError) as e:
+                logger.warning(f"IMAP connection lost ({e}), reconnecting")
+                self.connected = False
+                return self.connect()
+        
+        return True
+    
+    def _run(self, command: str, *args):
+        """Run an IMAP command, reconnecting and retrying once if the connection dropped"""
+        for attempt in range(2):
+            if not self._ensure_alive():
+                raise ConnectionError("Email server unavailable")
+            try:
+                result = getattr(self.client, command)(*args)
+                self._keepalive_at = time.monotonic()
+                return result
+            except (IMAPClientError, OSError) as e:
+                self.connected = False
+                if attempt:
+                    raise
+                logger.warning(f"IMAP {command} failed ({e}), reconnecting")
+    
+    def supports_idle(self) -> bool:
+        """Check whether the server accepts IMAP IDLE"""
         try:
-            # Calculate date threshold
-            since_date = datetime.now() - timedelta(days=since_days)
+            return self._ensure_alive() and self.client.has_capability('IDLE')
+        except (IMAPClientError, OSError) as e:
+            logger.error(f"Error checking IDLE capability: {e}")
+            return False
+    
+    def idle_wait(self, timeout: float = IDLE_TIMEOUT_SECONDS,
+                  keep_waiting: Callable[[], bool] = lambda: True) -> bool:
+        """
+        Wait in IMAP IDLE until the server announces new mail
+        
+        Args:
+            timeout: Maximum seconds to stay in IDLE
+            keep_waiting: Checked every few seconds; the wait ends when it returns False
             
-            # Search for emails since the date
-            search_criteria = ['SINCE', since_date.strftime('%d-%b-%Y')]
-            messages = self.client.search(search_criteria)
+        Returns:
+            True if new mail arrived or the connection dropped (a fetch will tell),
+            False on timeout or when asked to stop
+        """
+        if not self._ensure_alive():
+            time.sleep(IDLE_CHECK_SECONDS)
+            return False
+        
+        deadline = time.monotonic() + timeout
+        try:
+            self.client.idle()
+            try:
+                while keep_waiting():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    
+                    responses = self.client.idle_check(timeout=min(remaining, IDLE_CHECK_SECONDS))
+                    if any(len(response) > 1 and response[1] in _NEW_MAIL_RESPONSES for response in responses):
+                        return True
+                return False
+            finally:
+                self.client.idle_done()
+                self._keepalive_at = time.monotonic()
+                
+        except (IMAPClientError, OSError) as e:
+            logger.warning(f"IMAP IDLE interrupted ({e}), reconnecting")
+            self.connected = False
+            return True
+    
+    def fetch_new_emails(self, since_days: int = 1) -> Iterator[Dict]:
+        """
+        Fetch emails newer than the last seen UID (the last N days on first run)
+        
+        Emails are yielded as soon as their batch has been fetched and parsed,
+        so callers can start working while later batches are still in transit.
+        """
+        if not self._ensure_alive():
+            return
+        
+        try:
+            messages = self._search_new_uids(since_days)
             
             if not messages:
                 logger.info("No new emails found")
-                return []
+                return
             
-            # Limit to max emails per batch
-            messages = messages[-settings.max_emails_per_batch:]
+            # Fetch email data, one round trip per batch. The next batch is
+            # fetched on a helper thread while the current one is parsed and
+            # consumed; only that thread talks to the server during the loop.
+            fetched = 0
+            batch_size = max(1, settings.fetch_batch_size)
+            batches = [messages[start:start + batch_size] for start in range(0, len(messages), batch_size)]
             
-            # Fetch email data
-            emails = []
-            for msg_id in messages:
-                try:
-                    email_data = self._parse_email(msg_id)
-                    if email_data:
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error parsing email {msg_id}: {e}")
-                    continue
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap-prefetch") as prefetch:
+                pending = prefetch.submit(self._fetch_batch, batches[0])
+                for index, batch in enumerate(batches):
+                    try:
+                        responses = pending.result()
+                    except Exception as e:
+                        # Stop before this batch: last_seen_uid is not moved
+                        # past it, so the next poll fetches it again
+                        logger.error(f"Error fetching emails {batch[0]}-{batch[-1]}: {e}")
+                        break
+                    
+                    if index + 1 < len(batches):
+                        pending = prefetch.submit(self._fetch_batch, batches[index + 1])
+                    
+                    for msg_id, msg_data in responses.items():
+                        email_data = self._parse_fetched(msg_id, msg_data)
+                        if email_data:
+                            fetched += 1
+                            yield email_data
+                    
+                    # Only moved once every email of the batch has been handed
+                    # to the caller, so it never runs ahead of what the caller
+                    # received. Messages that failed to parse are not retried
+                    # on every poll.
+                    self.last_seen_uid = batch[-1]
             
-            logger.info(f"Fetched {len(emails)} new emails")
-            return emails
+            logger.info(f"Fetched {fetched} new emails")
             
         except Exception as e:
             logger.error(f"Error fetching emails: {e}")
-            return []
+    
+    def _fetch_batch(self, msg_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Fetch headers and the first text/plain section of a batch of messages
+        
+        Returns:
+            Mapping of UID to {'header': bytes, 'text': bytes or None,
+            'encoding': transfer encoding, 'charset': declared charset,
+            'internal_date': server arrival time}
+        """
+        responses = self._run('fetch', msg_ids, HEADER_FETCH_ITEMS)
+        
+        # One FETCH per distinct section number (almost always just "1")
+        fetched = {}
+        by_section: Dict[str, List[int]] = {}
+        for msg_id, msg_data in responses.items():
+            text_part = _find_text_section(msg_data.get(b'BODYSTRUCTURE'))
+            section, encoding, charset = text_part or (None, b'7bit', None)
+            fetched[msg_id] = {
+                'header': _section_data(msg_data, 'HEADER') or b'',
+                'internal_date': msg_data.get(b'INTERNALDATE'),
+                'text': None,
+                'encoding': encoding,
+                'charset': charset
+            }
+            if section:
+                by_section.setdefault(section, []).append(msg_id)
+        
+        for section, section_ids in by_section.items():
+            bodies = self._run('fetch', section_ids, [f'BODY.PEEK[{section}]<0.{TEXT_FETCH_BYTES}>'])
+            for msg_id, msg_data in bodies.items():
+                if msg_id in fetched:
+                    fetched[msg_id]['text'] = _section_data(msg_data, section)
+        
+        return fetched
     
     def _parse_email(self, msg_id: int) -> Optional[Dict]:
-        """Parse email message"""
+        """Fetch and parse a single email message"""
         try:
-            # Fetch email data
-            response = self.client.fetch([msg_id], ['RFC822', 'ENVELOPE', 'FLAGS'])
-            
-            if not response:
-                return None
-            
-            msg_data = response[msg_id]
-            raw_email = msg_data[b'RFC822']
-            
-            # Parse email
-            email_message = email.message_from_bytes(raw_email)
+            response = self._fetch_batch([msg_id])
+        except Exception as e:
+            logger.error(f"Error fetching email {msg_id}: {e}")
+            return None
+        
+        if not response or msg_id not in response:
+            return None
+        
+        return self._parse_fetched(msg_id, response[msg_id])
+    
+    def _parse_fetched(self, msg_id: int, msg_data: Dict) -> Optional[Dict]:
+        """Parse an already fetched email message (no IMAP I/O)"""
+        try:
+            # Parse headers
+            headers = BytesHeaderParser(policy=email.policy.default).parsebytes(msg_data['header'])
             
-            # Extract basic information
-            subject = email_message.get('Subject', '')
-            sender = email_message.get('From', '')
-            recipient = email_message.get('To', settings.email_address)
-            date_str = email_message.get('Date', '')
+            # Extract basic information (header objects are decoded str subclasses)
+            subject = str(headers.get('Subject', ''))
+            sender = str(headers.get('From', ''))
+            recipient = str(headers.get('To', settings.email_address))
+            date_str = str(headers.get('Date', ''))
             
-            # Parse date
+            # Parse date, falling back to the server's arrival time
             try:
-                date_received = email.utils.parsedate_to_datetime(date_str)
+                date_received = _parse_date_cached(date_str)
             except:
-                date_received = datetime.now()
+                date_received = msg_data.get('internal_date') or datetime.now()
             
             # Extract content
-            content = self._extract_content(email_message)
+            content = self._extract_content(msg_data)
             
-            # Create email data
+            # Create email data. Only headers and the text section were
+            # fetched; the UID is enough to fetch the whole message again.
             email_data = {
                 'uid': str(msg_id),
                 'subject': subject,
                 'sender': sender,
                 'recipient': recipient,
                 'date_received': date_received,
-                'content': content,
-                'raw_message': email_message
+                'content': content
             }
             
             return email_data
@@ -142,21 +470,14 @@ class EmailFetcher:
             logger.error(f"Error parsing email {msg_id}: {e}")
             return None
     
-    def _extract_content(self, email_message) -> str:
-        """Extract text content from email"""
+    def _extract_content(self, msg_data: Dict) -> str:
+        """Extract text content from the fetched text section"""
         content = ""
         
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        content += payload.decode('utf-8', errors='ignore')
-        else:
-            payload = email_message.get_payload(decode=True)
+        if msg_data['text']:
+            payload = _decode_transfer(msg_data['text'], msg_data['encoding'])
             if payload:
-                content = payload.decode('utf-8', errors='ignore')
+                content = _decode_text(payload, msg_data['charset'])
         
         return content.strip()
     
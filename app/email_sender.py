@@ -5,14 +5,27 @@ Handles automatic replies via SMTP
 
 import smtplib
 import ssl
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
 from app.config import settings
 
 
+# Loading the CA bundle is expensive: build the TLS context once per process
+_SSL_CTX = ssl.create_default_context()
+_SSL_CTX.options |= ssl.OP_NO_COMPRESSION
+
+# An SMTP session is reused for up to this many messages, and not once it has
+# sat idle this long: servers drop idle clients, and reconnecting up front is
+# cheaper than a send that fails on a dead session
+SMTP_MAX_MESSAGES = 100
+SMTP_IDLE_SECONDS = 100
+
+
 class EmailSender:
     """Email sender for automatic replies"""
     
@@ -21,6 +34,14 @@ class EmailSender:
         self.smtp_port = settings.email_smtp_port
         self.email_address = settings.email_address
         self.email_password = settings.email_password
+        self._from_header = formataddr(("SmartMailer", self.email_address))
+        
+        # One SMTP session is shared by consecutive replies (see SMTP_MAX_MESSAGES)
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+        self._smtp_sent = 0
+        self._smtp_used_at = 0.0
+        self.last_error: Optional[Exception] = None  # why the last test_connection() failed
     
     def send_auto_reply(self, original_email: Dict, reply_content: str) -> bool:
         """
@@ -33,29 +54,46 @@ class EmailSender:
         Returns:
             bool: True if sent successfully, False otherwise
         """
-        try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = formataddr(("SmartMailer", self.email_address))
-            msg['To'] = original_email.get('sender', '')
-            msg['Subject'] = self._format_reply_subject(original_email.get('subject', ''))
-            
-            # Add reply content
-            msg.attach(MIMEText(reply_content, 'html', 'utf-8'))
-            
-            # Send email
-            success = self._send_email(msg)
-            
-            if success:
-                logger.info(f"Auto-reply sent to {original_email.get('sender', '')}")
-            else:
-                logger.error(f"Failed to send auto-reply to {original_email.get('sender', '')}")
-            
-            return success
+        return self.send_auto_reply_batch([(original_email, reply_content)])[0]
+    
+    def send_auto_reply_batch(self, replies: List[Tuple[Dict, str]]) -> List[bool]:
+        """
+        Send several automatic replies over a single SMTP session
+        
+        Args:
+            replies: (original email data, reply content) pairs
             
-        except Exception as e:
-            logger.error(f"Error sending auto-reply: {e}")
-            return False
+        Returns:
+            List[bool]: Send result for each reply, in order
+        """
+        results = []
+        
+        with self._smtp_lock:
+            for original_email, reply_content in replies:
+                try:
+                    success = self._send_email(self._build_reply(original_email, reply_content))
+                except Exception as e:
+                    logger.error(f"Error sending auto-reply: {e}")
+                    success = False
+                
+                if success:
+                    logger.info("Auto-reply sent to {}", original_email.get('sender', ''))
+                else:
+                    logger.error(f"Failed to send auto-reply to {original_email.get('sender', '')}")
+                results.append(success)
+        
+        return results
+    
+    def _build_reply(self, original_email: Dict, reply_content: str) -> MIMEMultipart:
+        """Build the reply message for an email"""
+        msg = MIMEMultipart()
+        msg['From'] = self._from_header
+        msg['To'] = original_email.get('sender', '')
+        msg['Subject'] = self._format_reply_subject(original_email.get('subject', ''))
+        
+        # Add reply content
+        msg.attach(MIMEText(reply_content, 'html', 'utf-8'))
+        return msg
     
     def _format_reply_subject(self, original_subject: str) -> str:
         """Format reply subject"""
@@ -64,21 +102,57 @@ class EmailSender:
         else:
             return f"Re: {original_subject}"
     
+    def _connect_smtp(self) -> smtplib.SMTP:
+        """Open (or reuse) the SMTP session"""
+        if self._smtp is not None and (
+            self._smtp_sent >= SMTP_MAX_MESSAGES
+            or time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS
+        ):
+            self._close_smtp()
+        
+        if self._smtp is None:
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            try:
+                server.starttls(context=_SSL_CTX)
+                server.login(self.email_address, self.email_password)
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+            self._smtp_sent = 0
+        
+        self._smtp_used_at = time.monotonic()
+        return self._smtp
+    
+    def _close_smtp(self):
+        """Close the SMTP session if one is open"""
+        if self._smtp is None:
+            return
+        
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        finally:
+            self._smtp = None
+    
+    def close(self):
+        """Close the pooled SMTP session"""
+        with self._smtp_lock:
+            self._close_smtp()
+    
     def _send_email(self, msg: MIMEMultipart) -> bool:
-        """Send email via SMTP"""
+        """Send email via SMTP, reconnecting once if the session was dropped"""
         try:
-            # Create SSL context
-            context = ssl.create_default_context()
+            try:
+                self._connect_smtp().send_message(msg, from_addr=self.email_address)
+            except smtplib.SMTPServerDisconnected:
+                logger.warning("SMTP session dropped, reconnecting")
+                self._close_smtp()
+                self._connect_smtp().send_message(msg, from_addr=self.email_address)
             
-            # Connect to SMTP server
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email_address, self.email_password)
-                
-                # Send email
-                text = msg.as_string()
-                server.sendmail(self.email_address, msg['To'], text)
-                
+            self._smtp_sent += 1
+            self._smtp_used_at = time.monotonic()
             return True
             
         except Exception as e:
@@ -88,15 +162,19 @@ class EmailSender:
     def test_connection(self) -> bool:
         """Test SMTP connection"""
         try:
-            context = ssl.create_default_context()
-            
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email_address, self.email_password)
+            # Check through the pooled session, which later sends then reuse
+            with self._smtp_lock:
+                try:
+                    self._connect_smtp().noop()
+                except smtplib.SMTPServerDisconnected:
+                    self._close_smtp()
+                    self._connect_smtp().noop()
                 
             logger.info("SMTP connection test successful")
+            self.last_error = None
             return True
             
         except Exception as e:
             logger.error(f"SMTP connection test failed: {e}")
+            self.last_error = e
             return False
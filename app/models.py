@@ -3,10 +3,10 @@ Database models for SmartMailer
 """
 
 from datetime import datetime
-from typing import Optional
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, create_engine
+from typing import Dict, List, Optional
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Index, ForeignKey, create_engine, event, insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, relationship
 from app.config import settings
 
 Base = declarative_base()
@@ -22,7 +22,7 @@ class Email(Base):
     subject = Column(String, nullable=False)
     sender = Column(String, nullable=False)
     recipient = Column(String, nullable=False)
-    date_received = Column(DateTime, nullable=False)
+    date_received = Column(DateTime, nullable=False, index=True)
     content = Column(Text)
     classification = Column(String, nullable=False)  # 'normal' or 'important'
     auto_reply_sent = Column(Boolean, default=False)
@@ -30,6 +30,19 @@ class Email(Base):
     processed_at = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Log rows go with their email. The ORM deletes them itself: SQLite does
+    # not enforce ON DELETE CASCADE (foreign_keys is off) and tables created
+    # before the foreign key existed do not have it. Bulk deletes must remove
+    # the logs explicitly (see DatabaseManager.cleanup_old_emails).
+    logs = relationship("ProcessingLog", back_populates="email", cascade="all, delete-orphan")
+
+
+# Serves "filter by classification, newest first" listings
+Index('ix_email_class_date', Email.classification, Email.date_received.desc())
+
+# Serves "recently processed emails of a class" lookups
+Index('ix_emails_classification_processed_at', Email.classification, Email.processed_at)
 
 
 class ProcessingLog(Base):
@@ -38,21 +51,80 @@ class ProcessingLog(Base):
     __tablename__ = "processing_logs"
     
     id = Column(Integer, primary_key=True, index=True)
-    email_id = Column(Integer, nullable=False)
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="CASCADE"), nullable=False, index=True)
     action = Column(String, nullable=False)  # 'fetched', 'classified', 'replied', 'notified'
     status = Column(String, nullable=False)  # 'success', 'error'
     message = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    email = relationship("Email", back_populates="logs")
+
+
+class FetchState(Base):
+    """Last IMAP UID processed per folder, for incremental polling"""
+    
+    __tablename__ = "fetch_state"
+    
+    folder = Column(String, primary_key=True)
+    uid_validity = Column(Integer, nullable=True)
+    last_seen_uid = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 # Database setup
-engine = create_engine(settings.database_url, connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_engine(
+    settings.database_url,
+    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {},
+    pool_size=20,
+    max_overflow=30,
+    pool_recycle=3600,
+    pool_pre_ping=True
+)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune SQLite for the worker's many small writes"""
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run alongside the writer; NORMAL only fsyncs at checkpoints
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+# expire_on_commit=False keeps loaded attributes readable once the session closes
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 
 def create_tables():
     """Create all database tables"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips tables that already exist, so add any index
+    # introduced after the table was first created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def _bulk_insert(db: Session, model, rows: List[Dict], batch: int) -> int:
+    """Insert rows in executemany chunks, committing after each chunk"""
+    for start in range(0, len(rows), batch):
+        db.execute(insert(model), rows[start:start + batch])
+        db.commit()
+    return len(rows)
+
+
+def bulk_save_emails(db: Session, rows: List[Dict], batch: int = 500) -> int:
+    """Insert email rows (column dicts) in batches; returns rows written"""
+    return _bulk_insert(db, Email, rows, batch)
+
+
+def bulk_save_logs(db: Session, rows: List[Dict], batch: int = 500) -> int:
+    """Insert processing log rows (column dicts) in batches; returns rows written"""
+    return _bulk_insert(db, ProcessingLog, rows, batch)
 
 
 def get_db():
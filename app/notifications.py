@@ -4,11 +4,46 @@ Handles Telegram notifications for important emails
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Optional
+from urllib3.util.retry import Retry
 from loguru import logger
 from app.config import settings
 
 
+# Notification layout, filled with str.format_map
+_TG_TEMPLATE = """🚨 <b>Email Important Reçu</b>
+
+📧 <b>Expéditeur:</b> {sender}
+📝 <b>Sujet:</b> {subject}
+📅 <b>Date:</b> {date}
+
+📄 <b>Aperçu:</b>
+{preview}
+
+<i>Notification SmartMailer</i>"""
+
+PREVIEW_LENGTH = 150
+
+
+def _build_session() -> requests.Session:
+    """HTTP session keeping the TLS connection to the Bot API alive"""
+    # sendMessage (POST) is not idempotent: a 5xx may come after Telegram
+    # delivered the message, so status and read retries are for getMe (GET)
+    # only. Connect errors are still retried for every method, as nothing
+    # reached the server.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry))
+    return session
+
+
 class TelegramNotifier:
     """Telegram notification handler"""
     
@@ -16,6 +51,15 @@ class TelegramNotifier:
         self.bot_token = settings.telegram_bot_token
         self.chat_id = settings.telegram_chat_id
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.session = _build_session()
+        
+        # Only 'text' changes between messages
+        self._send_url = f"{self.base_url}/sendMessage"
+        self._payload_skeleton = {
+            'chat_id': self.chat_id,
+            'parse_mode': 'HTML',
+            'disable_web_page_preview': True
+        }
     
     def send_notification(self, email_data: Dict) -> bool:
         """
@@ -53,35 +97,23 @@ class TelegramNotifier:
         
         # Get content preview
         content = email_data.get('content', '')
-        content_preview = content[:150] + "..." if len(content) > 150 else content
-        
-        # Create message
-        message = f"""🚨 <b>Email Important Reçu</b>
-
-📧 <b>Expéditeur:</b> {sender}
-📝 <b>Sujet:</b> {subject}
-📅 <b>Date:</b> {date_str}
-
-📄 <b>Aperçu:</b>
-{content_preview}
-
-<i>Notification SmartMailer</i>"""
+        content_preview = content[:PREVIEW_LENGTH]
+        if len(content) > PREVIEW_LENGTH:
+            content_preview += "..."
         
-        return message
+        return _TG_TEMPLATE.format_map({
+            'sender': sender,
+            'subject': subject,
+            'date': date_str,
+            'preview': content_preview
+        })
     
     def _send_telegram_message(self, message: str) -> bool:
         """Send message to Telegram"""
         try:
-            url = f"{self.base_url}/sendMessage"
+            payload = {**self._payload_skeleton, 'text': message}
             
-            payload = {
-                'chat_id': self.chat_id,
-                'text': message,
-                'parse_mode': 'HTML',
-                'disable_web_page_preview': True
-            }
-            
-            response = requests.post(url, json=payload, timeout=10)
+            response = self.session.post(self._send_url, json=payload, timeout=10)
             
             if response.status_code == 200:
                 logger.info("Telegram notification sent successfully")
@@ -101,7 +133,7 @@ class TelegramNotifier:
         """Test Telegram bot connection"""
         try:
             url = f"{self.base_url}/getMe"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             
             if response.status_code == 200:
                 bot_info = response.json()
@@ -130,6 +162,10 @@ Ce message confirme que votre configuration Telegram fonctionne correctement.
         except Exception as e:
             logger.error(f"Error sending test message: {e}")
             return False
+    
+    def close(self):
+        """Close the pooled HTTP connections to the Bot API"""
+        self.session.close()
 
 
 class NotificationManager:
@@ -141,7 +177,7 @@ class NotificationManager:
     def notify_important_email(self, email_data: Dict) -> bool:
         """Send notification for important email"""
         try:
-            logger.info(f"Sending notification for important email: {email_data.get('subject', '')[:50]}...")
+            logger.info("Sending notification for important email: {:.50}...", email_data.get('subject', ''))
             return self.telegram.send_notification(email_data)
             
         except Exception as e:
@@ -165,3 +201,7 @@ class NotificationManager:
             results['telegram_message'] = False
         
         return results
+    
+    def close(self):
+        """Release the connections held by the notification channels"""
+        self.telegram.close()
@@ -4,44 +4,17 @@ Handles email templates using Jinja2
 """
 
 import os
-from typing import Dict, Any
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Final, Optional
 from jinja2 import Environment, FileSystemLoader, Template
 from loguru import logger
 from app.config import settings
 
 
-class TemplateManager:
-    """Template manager for email responses"""
-    
-    def __init__(self, templates_dir: str = "templates"):
-        self.templates_dir = templates_dir
-        self.env = Environment(
-            loader=FileSystemLoader(templates_dir),
-            autoescape=True
-        )
-        
-        # Create templates directory if it doesn't exist
-        os.makedirs(templates_dir, exist_ok=True)
-        
-        # Create default templates if they don't exist
-        self._create_default_templates()
-    
-    def _create_default_templates(self):
-        """Create default templates if they don't exist"""
-        
-        # Auto-reply template
-        auto_reply_path = os.path.join(self.templates_dir, "auto_reply.html")
-        if not os.path.exists(auto_reply_path):
-            self._create_auto_reply_template(auto_reply_path)
-        
-        # Notification template
-        notification_path = os.path.join(self.templates_dir, "notification.html")
-        if not os.path.exists(notification_path):
-            self._create_notification_template(notification_path)
-    
-    def _create_auto_reply_template(self, file_path: str):
-        """Create default auto-reply template"""
-        template_content = """<!DOCTYPE html>
+# Default templates, written to the templates directory when missing
+_AUTO_REPLY_DEFAULT: Final[str] = """<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -71,15 +44,8 @@ class TemplateManager:
     </div>
 </body>
 </html>"""
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(template_content)
-        
-        logger.info(f"Created default auto-reply template: {file_path}")
-    
-    def _create_notification_template(self, file_path: str):
-        """Create default notification template"""
-        template_content = """<!DOCTYPE html>
+
+_NOTIFICATION_DEFAULT: Final[str] = """<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -106,20 +72,120 @@ class TemplateManager:
     </div>
 </body>
 </html>"""
+
+# Used when a template fails to render (str.format placeholders)
+_FALLBACK_AUTO_REPLY: Final[str] = """
+        <html>
+        <body>
+            <h2>Merci pour votre message</h2>
+            <p>J'ai bien reçu votre email concernant "{subject}".</p>
+            <p>Je vous remercie de m'avoir contacté. Je traiterai votre demande dans les plus brefs délais.</p>
+            <p>Cordialement,<br>SmartMailer</p>
+        </body>
+        </html>
+        """
+
+_FALLBACK_NOTIFICATION: Final[str] = """
+        <html>
+        <body>
+            <h2>📧 Email Important Reçu</h2>
+            <p><strong>Expéditeur:</strong> {sender}</p>
+            <p><strong>Sujet:</strong> {subject}</p>
+            <p><strong>Date:</strong> {date_received}</p>
+        </body>
+        </html>
+        """
+
+
+def _format_received_date(date_received: datetime) -> str:
+    """Format a reception date for display"""
+    # Aware datetimes for the same instant compare equal whatever their
+    # timezone, so they cannot be the cache key: the displayed local time is
+    # what matters
+    return _format_wall_clock(date_received.replace(tzinfo=None))
+
+
+@lru_cache(maxsize=1024)
+def _format_wall_clock(wall_clock: datetime) -> str:
+    """Format a naive date and time (memoized per value)"""
+    return wall_clock.strftime('%d/%m/%Y à %H:%M')
+
+
+class TemplateManager:
+    """Template manager for email responses"""
+    
+    def __init__(self, templates_dir: str = "templates"):
+        self.templates_dir = templates_dir
+        # Keep every compiled template; auto_reload still picks up edits made
+        # to the files directly (e.g. through the Docker volume), at the cost
+        # of one stat per lookup
+        self.env = Environment(
+            loader=FileSystemLoader(templates_dir),
+            autoescape=True,
+            auto_reload=True,
+            cache_size=-1
+        )
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(template_content)
+        # Create templates directory if it doesn't exist
+        os.makedirs(templates_dir, exist_ok=True)
+        
+        # Create default templates if they don't exist
+        self._create_default_templates()
+        
+        # Bind the templates once instead of looking them up per email
+        self._auto_reply_tpl = self._load_template("auto_reply.html")
+        self._notification_tpl = self._load_template("notification.html")
+    
+    def _current_template(self, attr: str, name: str) -> Template:
+        """Return the bound template, recompiling it if its file changed on disk"""
+        template = getattr(self, attr)
+        if template is None or not template.is_up_to_date:
+            template = self.env.get_template(name)
+            setattr(self, attr, template)
+        return template
+    
+    def _load_template(self, name: str) -> Optional[Template]:
+        """Load a template, returning None if it cannot be compiled"""
+        try:
+            return self.env.get_template(name)
+        except Exception as e:
+            logger.error(f"Error loading template {name}: {e}")
+            return None
+    
+    def _create_default_templates(self):
+        """Create default templates if they don't exist"""
+        
+        # Auto-reply template
+        auto_reply_path = os.path.join(self.templates_dir, "auto_reply.html")
+        if not os.path.exists(auto_reply_path):
+            self._create_auto_reply_template(auto_reply_path)
+        
+        # Notification template
+        notification_path = os.path.join(self.templates_dir, "notification.html")
+        if not os.path.exists(notification_path):
+            self._create_notification_template(notification_path)
+    
+    def _create_auto_reply_template(self, file_path: str):
+        """Create default auto-reply template"""
+        Path(file_path).write_text(_AUTO_REPLY_DEFAULT, encoding='utf-8')
+        
+        logger.info(f"Created default auto-reply template: {file_path}")
+    
+    def _create_notification_template(self, file_path: str):
+        """Create default notification template"""
+        Path(file_path).write_text(_NOTIFICATION_DEFAULT, encoding='utf-8')
         
         logger.info(f"Created default notification template: {file_path}")
     
     def render_auto_reply(self, original_email: Dict, sender_name: str = "SmartMailer") -> str:
         """Render auto-reply template"""
         try:
-            template = self.env.get_template("auto_reply.html")
+            template = self._current_template('_auto_reply_tpl', "auto_reply.html")
             
+            date_received = original_email.get('date_received')
             context = {
                 'original_subject': original_email.get('subject', ''),
-                'received_date': original_email.get('date_received', '').strftime('%d/%m/%Y à %H:%M') if original_email.get('date_received') else '',
+                'received_date': _format_received_date(date_received) if date_received else '',
                 'sender_name': sender_name
             }
             
@@ -132,15 +198,16 @@ class TemplateManager:
     def render_notification(self, email_data: Dict) -> str:
         """Render notification template"""
         try:
-            template = self.env.get_template("notification.html")
+            template = self._current_template('_notification_tpl', "notification.html")
             
             content = email_data.get('content', '')
             content_preview = content[:200] + "..." if len(content) > 200 else content
             
+            date_received = email_data.get('date_received')
             context = {
                 'sender': email_data.get('sender', ''),
                 'subject': email_data.get('subject', ''),
-                'received_date': email_data.get('date_received', '').strftime('%d/%m/%Y à %H:%M') if email_data.get('date_received') else '',
+                'received_date': _format_received_date(date_received) if date_received else '',
                 'content_preview': content_preview
             }
             
@@ -152,34 +219,21 @@ class TemplateManager:
     
     def _get_fallback_auto_reply(self, original_email: Dict) -> str:
         """Fallback auto-reply if template fails"""
-        return f"""
-        <html>
-        <body>
-            <h2>Merci pour votre message</h2>
-            <p>J'ai bien reçu votre email concernant "{original_email.get('subject', '')}".</p>
-            <p>Je vous remercie de m'avoir contacté. Je traiterai votre demande dans les plus brefs délais.</p>
-            <p>Cordialement,<br>SmartMailer</p>
-        </body>
-        </html>
-        """
+        return _FALLBACK_AUTO_REPLY.format(subject=original_email.get('subject', ''))
     
     def _get_fallback_notification(self, email_data: Dict) -> str:
         """Fallback notification if template fails"""
-        return f"""
-        <html>
-        <body>
-            <h2>📧 Email Important Reçu</h2>
-            <p><strong>Expéditeur:</strong> {email_data.get('sender', '')}</p>
-            <p><strong>Sujet:</strong> {email_data.get('subject', '')}</p>
-            <p><strong>Date:</strong> {email_data.get('date_received', '')}</p>
-        </body>
-        </html>
-        """
+        return _FALLBACK_NOTIFICATION.format(
+            sender=email_data.get('sender', ''),
+            subject=email_data.get('subject', ''),
+            date_received=email_data.get('date_received', '')
+        )
     
     def get_template_list(self) -> list:
         """Get list of available templates"""
         try:
-            return [f for f in os.listdir(self.templates_dir) if f.endswith('.html')]
+            with os.scandir(self.templates_dir) as entries:
+                return [entry.name for entry in entries if entry.name.endswith('.html') and entry.is_file()]
         except Exception as e:
             logger.error(f"Error getting template list: {e}")
             return []
@@ -188,8 +242,16 @@ class TemplateManager:
         """Create a custom template"""
         try:
             file_path = os.path.join(self.templates_dir, f"{template_name}.html")
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            Path(file_path).write_text(content, encoding='utf-8')
+            
+            # A rewrite within the filesystem's mtime resolution would look unchanged
+            self.env.cache.clear()
+            
+            # Rebind if a default template was overridden
+            if template_name == "auto_reply":
+                self._auto_reply_tpl = self._load_template("auto_reply.html")
+            elif template_name == "notification":
+                self._notification_tpl = self._load_template("notification.html")
             
             logger.info(f"Created custom template: {template_name}")
             return True
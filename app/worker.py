@@ -4,18 +4,29 @@ Orchestrates email processing workflow
 """
 
 import time
-import schedule
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from loguru import logger
 
 from app.config import settings
-from app.email_fetcher import EmailFetcher
+from app.email_fetcher import EmailFetcher, FOLDER, IDLE_TIMEOUT_SECONDS
 from app.email_classifier import EmailClassifier
 from app.email_sender import EmailSender
 from app.templates import TemplateManager
 from app.notifications import NotificationManager
 from app.database import DatabaseManager
+from app.models import create_tables
+from app.dispatcher import Dispatcher
+
+
+# Auto-replies are handed to the dispatcher in chunks sharing one SMTP session
+AUTO_REPLY_BATCH_SIZE = 100
+
+# Stored UIDs kept in memory. Only recent mail comes back from the server
+# (the SINCE scan after a restart); older UIDs are checked in the database.
+SEEN_UIDS_LIMIT = 10_000
 
 
 class SmartMailerWorker:
@@ -28,10 +39,27 @@ class SmartMailerWorker:
         self.templates = TemplateManager()
         self.notifications = NotificationManager()
         self.db = DatabaseManager()
+        self.dispatcher = Dispatcher()
+        
+        # The worker may run without the API (python main.py worker), so it
+        # creates what it needs itself; create_all skips existing tables
+        create_tables()
+        
+        # Auto-replies rendered during the current cycle: (email id, email data, reply)
+        self._pending_replies: List[Tuple[int, Dict, str]] = []
         
         self.running = False
         self.last_check = None
         
+        # Resume incremental IMAP polling where the previous run stopped
+        state = self.db.get_fetch_state(FOLDER)
+        if state:
+            self.fetcher.restore_state(*state)
+        
+        # UIDs known to be stored: the initial SINCE scan returns recent mail
+        # again after a restart, and those emails are skipped without any work
+        self._seen_uids: Set[str] = self.db.get_recent_uids(days=2)
+        
         logger.info("SmartMailer Worker initialized")
     
     def start(self):
@@ -42,21 +70,42 @@ class SmartMailerWorker:
             # Test all connections
             if not self._test_connections():
                 logger.error("Connection tests failed. Please check your configuration.")
+                self.fetcher.disconnect()
                 return False
             
-            # Schedule email checking
-            schedule.every(settings.check_interval_minutes).minutes.do(self.process_emails)
-            
             self.running = True
-            logger.info(f"Worker started. Checking emails every {settings.check_interval_minutes} minutes.")
             
             # Run initial check
             self.process_emails()
             
-            # Main loop
+            interval = settings.check_interval_minutes * 60
+            
+            # Let the server push new mail when it can, otherwise poll
+            if self.fetcher.supports_idle():
+                logger.info("Worker started. Waiting for new emails with IMAP IDLE.")
+                idle_timeout = min(IDLE_TIMEOUT_SECONDS, interval)
+                while self.running:
+                    # Fetch after every wait, timeouts included: mail that
+                    # arrived between the last search and the IDLE command is
+                    # never announced inside IDLE, so the check interval bounds
+                    # how long it can wait
+                    self.fetcher.idle_wait(timeout=idle_timeout, keep_waiting=lambda: self.running)
+                    if self.running:
+                        self.process_emails()
+                return
+            
+            logger.info(f"Worker started. Checking emails every {settings.check_interval_minutes} minutes.")
+            
+            # Main loop: poll on a monotonic deadline, unaffected by clock changes
+            next_run = time.monotonic() + interval
             while self.running:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
+                sleep_for = next_run - time.monotonic()
+                if sleep_for > 0:
+                    time.sleep(min(sleep_for, 1.0))
+                    continue
+                
+                self.process_emails()
+                next_run += interval
                 
         except KeyboardInterrupt:
             logger.info("Worker stopped by user")
@@ -69,6 +118,9 @@ class SmartMailerWorker:
         """Stop the worker"""
         self.running = False
         self.fetcher.disconnect()
+        self.dispatcher.shutdown(wait=True)
+        self.notifications.close()
+        self.sender.close()
         self.db.close()
         logger.info("SmartMailer Worker stopped")
     
@@ -76,124 +128,179 @@ class SmartMailerWorker:
         """Test all external connections"""
         logger.info("Testing connections...")
         
-        # Test email connection
-        try:
-            if not self.fetcher.connect():
-                logger.error("Email connection failed")
-                return False
-            self.fetcher.disconnect()
-            logger.info("✓ Email connection: OK")
-        except Exception as e:
-            logger.error(f"✗ Email connection failed: {e}")
-            return False
-        
-        # Test SMTP connection
-        try:
-            if not self.sender.test_connection():
-                logger.error("SMTP connection failed")
-                return False
-            logger.info("✓ SMTP connection: OK")
-        except Exception as e:
-            logger.error(f"✗ SMTP connection failed: {e}")
-            return False
-        
-        # Test Telegram connection
-        try:
-            telegram_test = self.notifications.test_all_notifications()
-            if telegram_test.get('telegram_connection'):
-                logger.info("✓ Telegram connection: OK")
-            else:
-                logger.warning("⚠ Telegram connection: FAILED")
-        except Exception as e:
-            logger.error(f"✗ Telegram connection failed: {e}")
-            return False
+        # name -> (probe, whether a failure blocks start-up); the email
+        # connection stays open for the processing cycles
+        probes = {
+            'Email': (self.fetcher.connect, True),
+            'SMTP': (self.sender.test_connection, True),
+            'Telegram': (lambda: self.notifications.test_all_notifications().get('telegram_connection'), False),
+            'Database': (lambda: 'total_emails' in self.db.get_processing_stats(), True),
+        }
         
-        # Test database
-        try:
-            stats = self.db.get_processing_stats()
-            logger.info("✓ Database connection: OK")
-        except Exception as e:
-            logger.error(f"✗ Database connection failed: {e}")
-            return False
+        # The probes are independent: run them side by side so start-up
+        # waits for the slowest handshake rather than the sum of them
+        all_ok = True
+        with ThreadPoolExecutor(max_workers=len(probes), thread_name_prefix="smartmailer-probe") as pool:
+            futures = {pool.submit(probe): (name, required) for name, (probe, required) in probes.items()}
+            for future in as_completed(futures):
+                name, required = futures[future]
+                try:
+                    if future.result():
+                        logger.info(f"✓ {name} connection: OK")
+                    elif required:
+                        logger.error(f"✗ {name} connection failed")
+                        all_ok = False
+                    else:
+                        logger.warning(f"⚠ {name} connection: FAILED")
+                except Exception as e:
+                    logger.error(f"✗ {name} connection failed: {e}")
+                    all_ok = False
         
-        return True
+        return all_ok
     
     def process_emails(self):
         """Main email processing function"""
         try:
             logger.info("Starting email processing cycle...")
-            start_time = datetime.now()
+            start_ns = time.monotonic_ns()  # durations ignore wall-clock adjustments
             
-            # Connect to email server
-            if not self.fetcher.connect():
+            # Reuse the long-lived connection; commands reconnect on their own if it dropped
+            if not self.fetcher.connected and not self.fetcher.connect():
                 logger.error("Failed to connect to email server")
                 return
             
             try:
-                # Fetch new emails
+                # Fetch new emails; they arrive batch by batch while the
+                # following ones are still being downloaded
                 emails = self.fetcher.fetch_new_emails(since_days=1)
                 
-                if not emails:
+                # Last UID known to be stored; the fetcher is rewound there if
+                # a batch cannot be saved
+                stored_uid = self.fetcher.last_seen_uid
+                save_failed = False
+                
+                # Classify and store in batches, then handle each email
+                total_count = processed_count = 0
+                batch_size = max(1, settings.fetch_batch_size)
+                while True:
+                    batch = list(islice(emails, batch_size))
+                    if not batch:
+                        break
+                    total_count += len(batch)
+                    
+                    # Every email at or below the fetcher's cursor has now been
+                    # handed over (in this batch or an earlier one), whatever
+                    # the UID gaps or parse failures
+                    batch_boundary = self.fetcher.last_seen_uid
+                    
+                    batch_processed = self._process_batch(batch)
+                    if batch_processed is None:
+                        # Leave the rest for the next poll, which starts again
+                        # right after the last stored email
+                        emails.close()
+                        self.fetcher.last_seen_uid = stored_uid
+                        save_failed = True
+                        break
+                    
+                    processed_count += batch_processed
+                    stored_uid = batch_boundary
+                
+                if not total_count:
                     logger.info("No new emails to process")
                     return
                 
-                logger.info(f"Processing {len(emails)} emails...")
-                
-                # Process each email
-                processed_count = 0
-                for email_data in emails:
-                    try:
-                        if self._process_single_email(email_data):
-                            processed_count += 1
-                    except Exception as e:
-                        logger.error(f"Error processing email {email_data.get('uid', 'unknown')}: {e}")
-                        continue
+                # Remember how far this cycle got
+                if not save_failed and self.fetcher.last_seen_uid is not None:
+                    self.db.save_fetch_state(FOLDER, self.fetcher.uid_validity, self.fetcher.last_seen_uid)
                 
                 # Update last check time
                 self.last_check = datetime.now()
                 
                 # Log processing summary
-                duration = (datetime.now() - start_time).total_seconds()
-                logger.info(f"Processing cycle completed: {processed_count}/{len(emails)} emails processed in {duration:.2f}s")
+                duration = (time.monotonic_ns() - start_ns) / 1e9
+                logger.info(f"Processing cycle completed: {processed_count}/{total_count} emails processed in {duration:.2f}s")
                 
             finally:
-                self.fetcher.disconnect()
+                # Hand the collected auto-replies to the background senders
+                self._dispatch_pending_replies()
+                self.db.flush_logs()
                 
         except Exception as e:
             logger.error(f"Error in email processing cycle: {e}")
     
-    def _process_single_email(self, email_data: Dict) -> bool:
-        """Process a single email"""
-        try:
+    def _process_batch(self, emails: List[Dict]) -> Optional[int]:
+        """
+        Classify and save a batch of emails at once
+        
+        Returns:
+            How many were processed, or None if the batch could not be saved
+        """
+        new_emails = [email_data for email_data in emails if email_data.get('uid') not in self._seen_uids]
+        
+        # Older mail the set does not know about is checked with a single query
+        stored = self.db.get_existing_uids([email_data.get('uid') for email_data in new_emails])
+        if stored:
+            self._remember_uids(stored)
+            new_emails = [email_data for email_data in new_emails if email_data.get('uid') not in stored]
+        
+        processed_count = len(emails) - len(new_emails)
+        if not new_emails:
+            return processed_count
+        emails = new_emails
+        
+        classifications = self.classifier.classify_batch(emails)
+        
+        # One INSERT for the batch; emails already stored are left out
+        saved = self.db.save_emails_bulk(list(zip(emails, classifications)))
+        if saved is None:
+            logger.error(f"Failed to save {len(emails)} emails to database")
+            return None
+        
+        self._remember_uids(email_data.get('uid') for email_data in emails)
+        
+        for email_data, classification in zip(emails, classifications):
             email_uid = email_data.get('uid')
-            logger.info(f"Processing email: {email_data.get('subject', 'No Subject')[:50]}...")
-            
-            # Check if email already processed
-            existing_email = self.db.get_email_by_uid(email_uid)
-            if existing_email:
-                logger.debug(f"Email {email_uid} already processed, skipping")
-                return True
+            email_id = saved.get(email_uid)
+            if email_id is None:
+                logger.debug("Email {} already processed, skipping", email_uid)
+                processed_count += 1
+                continue
             
-            # Classify email
-            classification = self.classifier.classify_email(email_data)
-            
-            # Save email to database
-            email_record = self.db.save_email(email_data, classification)
-            if not email_record:
-                logger.error(f"Failed to save email {email_uid} to database")
-                return False
+            try:
+                if self._process_single_email(email_data, classification, email_id):
+                    processed_count += 1
+            except Exception as e:
+                logger.error(f"Error processing email {email_uid}: {e}")
+        
+        return processed_count
+    
+    def _remember_uids(self, uids: Iterable[str]):
+        """Add stored UIDs to the in-memory set, keeping only the most recent ones"""
+        self._seen_uids.update(uids)
+        
+        # Trim back to the limit once it is doubled, so pruning stays rare.
+        # (length, text) orders numeric UIDs numerically without int(), which
+        # would fail on non-IMAP UIDs such as the demo's
+        if len(self._seen_uids) > 2 * SEEN_UIDS_LIMIT:
+            newest = sorted(self._seen_uids, key=lambda uid: (len(uid), uid))[-SEEN_UIDS_LIMIT:]
+            self._seen_uids = set(newest)
+    
+    def _process_single_email(self, email_data: Dict, classification: str, email_id: int) -> bool:
+        """Process a single classified and saved email"""
+        try:
+            logger.info("Processing email: {:.50}...", email_data.get('subject', 'No Subject'))
             
             # Log classification
             self.db.log_processing_action(
-                email_record.id, 'classified', 'success', 
+                email_id, 'classified', 'success', 
                 f"Classified as {classification}"
             )
             
             # Process based on classification
             if classification == 'normal':
-                return self._process_normal_email(email_record, email_data)
+                return self._process_normal_email(email_id, email_data)
             elif classification == 'important':
-                return self._process_important_email(email_record, email_data)
+                return self._process_important_email(email_id, email_data)
             else:
                 logger.warning(f"Unknown classification: {classification}")
                 return False
@@ -202,68 +309,91 @@ class SmartMailerWorker:
             logger.error(f"Error processing single email: {e}")
             return False
     
-    def _process_normal_email(self, email_record, email_data: Dict) -> bool:
-        """Process normal email (send auto-reply)"""
+    def _process_normal_email(self, email_id: int, email_data: Dict) -> bool:
+        """Process normal email (queue an auto-reply)"""
         try:
             if not settings.auto_reply_enabled:
                 logger.info("Auto-reply disabled, skipping")
                 return True
             
-            # Generate auto-reply content
+            # Generate auto-reply content; it is sent at the end of the cycle
             reply_content = self.templates.render_auto_reply(email_data)
-            
-            # Send auto-reply
-            if self.sender.send_auto_reply(email_data, reply_content):
-                # Update database
-                self.db.mark_auto_reply_sent(email_record.id)
+            self._pending_replies.append((email_id, email_data, reply_content))
+            return True
+                
+        except Exception as e:
+            logger.error(f"Error processing normal email: {e}")
+            self.db.log_processing_action(
+                email_id, 'auto_reply_sent', 'error', str(e)
+            )
+            return False
+    
+    def _dispatch_pending_replies(self):
+        """Submit the cycle's auto-replies to the dispatcher in SMTP batches"""
+        pending = self._pending_replies
+        for start in range(0, len(pending), AUTO_REPLY_BATCH_SIZE):
+            self.dispatcher.submit('smtp', self._send_reply_batch, pending[start:start + AUTO_REPLY_BATCH_SIZE])
+        self._pending_replies = []
+    
+    def _send_reply_batch(self, batch: List[Tuple[int, Dict, str]]):
+        """Send a batch of auto-replies and record the outcome (background thread)"""
+        results = self.sender.send_auto_reply_batch(
+            [(email_data, reply_content) for _, email_data, reply_content in batch]
+        )
+        
+        # One UPDATE for every reply that went out
+        self.db.update_emails_status(
+            [email_id for (email_id, _, _), success in zip(batch, results) if success],
+            auto_reply_sent=True
+        )
+        
+        for (email_id, _, _), success in zip(batch, results):
+            if success:
                 self.db.log_processing_action(
-                    email_record.id, 'auto_reply_sent', 'success', 
+                    email_id, 'auto_reply_sent', 'success', 
                     'Auto-reply sent successfully'
                 )
-                
-                logger.info(f"Auto-reply sent for email {email_record.id}")
-                return True
+                logger.info("Auto-reply sent for email {}", email_id)
             else:
                 self.db.log_processing_action(
-                    email_record.id, 'auto_reply_sent', 'error', 
+                    email_id, 'auto_reply_sent', 'error', 
                     'Failed to send auto-reply'
                 )
-                logger.error(f"Failed to send auto-reply for email {email_record.id}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error processing normal email: {e}")
-            self.db.log_processing_action(
-                email_record.id, 'auto_reply_sent', 'error', str(e)
-            )
-            return False
+                logger.error(f"Failed to send auto-reply for email {email_id}")
+        
+        self.db.flush_logs()
+    
+    def _process_important_email(self, email_id: int, email_data: Dict) -> bool:
+        """Process important email (queue a notification)"""
+        self.dispatcher.submit('telegram', self._send_notification, email_id, email_data)
+        return True
     
-    def _process_important_email(self, email_record, email_data: Dict) -> bool:
-        """Process important email (send notification)"""
+    def _send_notification(self, email_id: int, email_data: Dict) -> bool:
+        """Send the Telegram notification for an important email (background thread)"""
         try:
             # Send Telegram notification
             if self.notifications.notify_important_email(email_data):
                 # Update database
-                self.db.mark_notification_sent(email_record.id)
+                self.db.mark_notification_sent(email_id)
                 self.db.log_processing_action(
-                    email_record.id, 'notification_sent', 'success', 
+                    email_id, 'notification_sent', 'success', 
                     'Telegram notification sent successfully'
                 )
                 
-                logger.info(f"Notification sent for important email {email_record.id}")
+                logger.info("Notification sent for important email {}", email_id)
                 return True
             else:
                 self.db.log_processing_action(
-                    email_record.id, 'notification_sent', 'error', 
+                    email_id, 'notification_sent', 'error', 
                     'Failed to send Telegram notification'
                 )
-                logger.error(f"Failed to send notification for email {email_record.id}")
+                logger.error(f"Failed to send notification for email {email_id}")
                 return False
                 
         except Exception as e:
             logger.error(f"Error processing important email: {e}")
             self.db.log_processing_action(
-                email_record.id, 'notification_sent', 'error', str(e)
+                email_id, 'notification_sent', 'error', str(e)
             )
             return False
     
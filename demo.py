@@ -2,13 +2,31 @@
 Démonstration des fonctionnalités SmartMailer
 """
 
+import io
 import sys
+from contextlib import redirect_stdout
+from functools import wraps
 from pathlib import Path
 from datetime import datetime
 
 # Add app directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
+def buffered_output(demo):
+    """Regroupe les affichages d'une démonstration en une seule écriture sur stdout"""
+    @wraps(demo)
+    def wrapper(*args, **kwargs):
+        buffer = io.StringIO()
+        try:
+            with redirect_stdout(buffer):
+                return demo(*args, **kwargs)
+        finally:
+            sys.stdout.write(buffer.getvalue())
+            sys.stdout.flush()
+    return wrapper
+
+
+@buffered_output
 def demo_classification():
     """Démonstration de la classification d'emails"""
     print("🤖 DÉMONSTRATION - Classification d'emails")
@@ -42,8 +60,9 @@ def demo_classification():
         }
     ]
     
-    for i, email in enumerate(emails, 1):
-        classification = classifier.classify_email(email)
+    classifications = classifier.classify_batch(emails)
+    
+    for i, (email, classification) in enumerate(zip(emails, classifications), 1):
         emoji = "🚨" if classification == "important" else "📧"
         
         print(f"\n{emoji} Email {i}: {classification.upper()}")
@@ -53,6 +72,7 @@ def demo_classification():
     
     print("\n" + "=" * 50)
 
+@buffered_output
 def demo_templates():
     """Démonstration des templates"""
     print("📝 DÉMONSTRATION - Templates de réponse")
@@ -84,6 +104,7 @@ def demo_templates():
     
     print("\n" + "=" * 50)
 
+@buffered_output
 def demo_database():
     """Démonstration de la base de données"""
     print("🗄️ DÉMONSTRATION - Base de données")
@@ -117,17 +138,17 @@ def demo_database():
     
     print("💾 Sauvegarde d'emails simulés...")
     
-    for email_data in sample_emails:
-        # Classifier l'email
-        classification = classifier.classify_email(email_data)
-        
-        # Sauvegarder en base
-        email_record = db.save_email(email_data, classification)
-        
-        if email_record:
+    # Classifier puis sauvegarder tous les emails en une fois
+    classifications = classifier.classify_batch(sample_emails)
+    saved = db.save_emails_bulk(list(zip(sample_emails, classifications)))
+    
+    for email_data, classification in zip(sample_emails, classifications):
+        if saved is None:
+            print(f"✗ Erreur sauvegarde: {email_data['subject'][:30]}...")
+        elif email_data['uid'] in saved:
             print(f"✓ Email sauvegardé: {email_data['subject'][:30]}... ({classification})")
         else:
-            print(f"✗ Erreur sauvegarde: {email_data['subject'][:30]}...")
+            print(f"✓ Email déjà en base: {email_data['subject'][:30]}... ({classification})")
     
     # Afficher les statistiques
     print("\n📊 Statistiques de la base de données:")
@@ -145,6 +166,7 @@ def demo_database():
     db.close()
     print("\n" + "=" * 50)
 
+@buffered_output
 def demo_api_endpoints():
     """Démonstration des endpoints API"""
     print("🌐 DÉMONSTRATION - API Endpoints")
@@ -169,6 +191,7 @@ def demo_api_endpoints():
     
     print("\n" + "=" * 50)
 
+@buffered_output
 def demo_workflow():
     """Démonstration du workflow complet"""
     print("🔄 DÉMONSTRATION - Workflow complet")
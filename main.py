@@ -2,16 +2,21 @@
 Main entry point for SmartMailer
 """
 
+import os
 import sys
 import argparse
+import threading
 from loguru import logger
-from app.worker import SmartMailerWorker
-from app.api import app
-import uvicorn
+from app.config import settings
+
+# The worker and the API stack are imported by the mode that needs them, so
+# `main.py worker` never loads FastAPI and `main.py api` never loads IMAP code
 
 
 def run_worker():
     """Run the email processing worker"""
+    from app.worker import SmartMailerWorker
+    
     logger.info("Starting SmartMailer Worker...")
     worker = SmartMailerWorker()
     worker.start()
@@ -19,16 +24,67 @@ def run_worker():
 
 def run_api():
     """Run the FastAPI server"""
+    import uvicorn
+    
     logger.info("Starting SmartMailer API...")
+    if settings.debug:
+        # Development: restart on code changes
+        uvicorn.run(
+            "app.api:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            log_level="info"
+        )
+        return
+    
+    # One-time startup work, done here rather than in every API process:
+    # concurrent create_all calls race on the same SQLite indexes, and each
+    # process would send its own Telegram test message
+    from app.api import STARTUP_CHECKED_ENV, test_connections
+    from app.models import create_tables
+    create_tables()
+    test_connections()
+    os.environ[STARTUP_CHECKED_ENV] = "1"
+    
+    # Production: one process per core; "auto" picks uvloop and httptools
+    # when they are installed (uvicorn[standard])
     uvicorn.run(
         "app.api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        workers=settings.api_workers or os.cpu_count(),
+        loop="auto",
+        http="auto",
+        access_log=False,
         log_level="info"
     )
 
 
+def run_both():
+    """Run the worker and the API in the same process"""
+    import uvicorn
+    from app.api import app
+    from app.worker import SmartMailerWorker
+    
+    logger.info("Starting SmartMailer Worker and API...")
+    worker = SmartMailerWorker()
+    
+    # The worker blocks on IMAP, so it gets its own thread; uvicorn keeps the
+    # main thread for its signal handling
+    worker_thread = threading.Thread(target=worker.start, name="smartmailer-worker", daemon=True)
+    worker_thread.start()
+    
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=8000, access_log=settings.debug, log_level="info"))
+    try:
+        server.run()
+    finally:
+        # Let the worker finish its current wait before closing its connections
+        worker.running = False
+        worker_thread.join(timeout=10)
+        worker.stop()
+
+
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(description="SmartMailer - Application intelligente de gestion d'emails")
@@ -55,7 +111,6 @@ def main():
     )
     
     # Create logs directory
-    import os
     os.makedirs("logs", exist_ok=True)
     
     try:
@@ -64,28 +119,7 @@ def main():
         elif args.mode == "api":
             run_api()
         elif args.mode == "both":
-            # Run both in separate processes
-            import multiprocessing
-            
-            # Start worker process
-            worker_process = multiprocessing.Process(target=run_worker)
-            worker_process.start()
-            
-            # Start API process
-            api_process = multiprocessing.Process(target=run_api)
-            api_process.start()
-            
-            try:
-                # Wait for both processes
-                worker_process.join()
-                api_process.join()
-            except KeyboardInterrupt:
-                logger.info("Shutting down...")
-                worker_process.terminate()
-                api_process.terminate()
-                worker_process.join()
-                api_process.join()
-                
+            run_both()
     except KeyboardInterrupt:
         logger.info("Application stopped by user")
     except Exception as e:
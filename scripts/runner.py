@@ -0,0 +1,219 @@
+"""
+Concurrent runner for the SmartMailer check scripts
+Runs independent checks side by side and prints each one's output in one block
+"""
+
+import imaplib
+import io
+import random
+import smtplib
+import socket
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext, redirect_stdout
+from functools import wraps
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+
+# Same layout as the console handler in main.py
+LOG_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
+
+
+# Errors worth another attempt; anything else (bad credentials, bad config)
+# will not fix itself
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+    smtplib.SMTPServerDisconnected,
+    imaplib.IMAP4.abort,
+)
+
+
+def retry_on_failure(attempts: int = 3, initial: float = 1.0, max_wait: float = 30.0, jitter: float = 0.5):
+    """
+    Retry a network check that hit a transient error, with exponential backoff and jitter
+
+    A DNS blip or a reset TLS handshake should not fail the whole run. Only
+    TRANSIENT_ERRORS are retried: a failed assert or an authentication error
+    fails on the first attempt, since trying again cannot fix it.
+    """
+    def decorate(test_func: Callable[[], None]) -> Callable[[], None]:
+        @wraps(test_func)
+        def wrapper():
+            for attempt in range(attempts):
+                if attempt:
+                    delay = min(max_wait, initial * 2 ** (attempt - 1)) + random.uniform(0, jitter)
+                    print(f"↻ Retrying in {delay:.1f}s ({attempt + 1}/{attempts})...")
+                    time.sleep(delay)
+
+                try:
+                    return test_func()
+                except TRANSIENT_ERRORS as e:
+                    if attempt + 1 == attempts:
+                        raise
+                    print(f"⚠ Transient error: {type(e).__name__}: {e}")
+        return wrapper
+    return decorate
+
+
+class _PerThreadStdout(io.TextIOBase):
+    """stdout replacement sending each test thread's prints to its own buffer"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buffer):
+        """Route the current thread's output to buffer (None: back to the real stream)"""
+        self._local.buffer = buffer
+
+    def write(self, text: str) -> int:
+        return (getattr(self._local, 'buffer', None) or self._stream).write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def _is_serial(test_func: Callable[[], None]) -> bool:
+    """Whether the test carries @pytest.mark.serial"""
+    return any(mark.name == 'serial' for mark in getattr(test_func, 'pytestmark', []))
+
+
+def _skip_reason(test_func: Callable[[], None]) -> Optional[str]:
+    """Reason of the first skip/skipif mark that applies to the test, if any"""
+    for mark in getattr(test_func, 'pytestmark', []):
+        if mark.name == 'skip' or (mark.name == 'skipif' and mark.args and mark.args[0]):
+            return mark.kwargs.get('reason', 'skipped')
+    return None
+
+
+class TestOutcome(NamedTuple):
+    """What running one test produced"""
+    passed: Optional[bool]  # None if skipped
+    output: str
+    seconds: float
+    message: str = ""  # failure or skip reason
+
+
+def _run_captured(stdout: _PerThreadStdout, test_name: str, test_func: Callable[[], None],
+                  lock: Optional[threading.Lock] = None) -> TestOutcome:
+    """Run one pytest-style test with its output buffered"""
+    skip_reason = _skip_reason(test_func)
+    if skip_reason:
+        return TestOutcome(None, f"\n⏭ {test_name} skipped: {skip_reason}\n", 0.0, skip_reason)
+
+    buffer = io.StringIO()
+    message = ""
+    stdout.capture(buffer)
+    start = time.perf_counter()
+    try:
+        with lock or nullcontext():
+            test_func()
+        result = True
+    except AssertionError as e:
+        message = str(e)
+        print(f"✗ {e}")
+        result = False
+    except Exception as e:
+        message = f"{type(e).__name__}: {e}"
+        print(f"✗ {test_name} failed: {type(e).__name__}: {e}")
+        result = False
+    finally:
+        stdout.capture(None)
+    return TestOutcome(result, buffer.getvalue(), time.perf_counter() - start, message)
+
+
+def write_junit_xml(path: str, suite_name: str, outcomes: Dict[str, TestOutcome]):
+    """Write the outcomes as a JUnit XML report, the format CI test reporters read"""
+    suite = ET.Element(
+        "testsuite",
+        name=suite_name,
+        tests=str(len(outcomes)),
+        failures=str(sum(outcome.passed is False for outcome in outcomes.values())),
+        skipped=str(sum(outcome.passed is None for outcome in outcomes.values())),
+        time=f"{sum(outcome.seconds for outcome in outcomes.values()):.3f}",
+    )
+    for name, outcome in outcomes.items():
+        case = ET.SubElement(suite, "testcase", classname=suite_name, name=name, time=f"{outcome.seconds:.3f}")
+        if outcome.passed is None:
+            ET.SubElement(case, "skipped", message=outcome.message)
+        elif not outcome.passed:
+            ET.SubElement(case, "failure", message=outcome.message)
+        ET.SubElement(case, "system-out").text = outcome.output
+
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def run_tests(tests: List[Tuple[str, Callable[[], None]]], junit_xml: Optional[str] = None,
+              suite_name: str = "smartmailer") -> Dict[str, Optional[bool]]:
+    """
+    Run independent pytest-style tests concurrently, outside pytest
+
+    A test passes when it returns without raising; a failed assert fails it.
+
+    The tests mostly wait on the network (TLS handshakes, logins), so running
+    them together takes as long as the slowest one instead of their sum.
+    Tests marked serial (shared sqlite file, per-account IMAP login cap) still
+    run one at a time, alongside the others. Log records from the app code go
+    to the same per-test buffer as the test's prints, so they cannot land in
+    the middle of another test's block either (remove loguru's default
+    stderr handler first to see them there only).
+
+    Args:
+        tests: (name, test function) pairs
+        junit_xml: Also write a JUnit XML report to this path
+        suite_name: Test suite name used in the report
+
+    Returns:
+        Test name -> passed (None if skipped), in the order the tests were given
+    """
+    stdout = _PerThreadStdout(sys.stdout)
+    serial_lock = threading.Lock()
+    outcomes = {}
+
+    # The sink must write synchronously (no enqueue): the proxy picks the
+    # buffer from the thread that logged. Only this sink is removed afterwards;
+    # the caller's own handlers are left alone
+    log_handler = logger.add(stdout, level="INFO", format=LOG_FORMAT, colorize=False)
+    try:
+        with redirect_stdout(stdout), ThreadPoolExecutor(max_workers=len(tests)) as pool:
+            futures = {
+                pool.submit(_run_captured, stdout, name, func, serial_lock if _is_serial(func) else None): name
+                for name, func in tests
+            }
+
+            # Print each test's block as soon as it finishes so output never interleaves
+            for future in as_completed(futures):
+                outcome = outcomes[futures[future]] = future.result()
+                stdout.write(outcome.output)
+                stdout.flush()
+    finally:
+        logger.remove(log_handler)
+
+    outcomes = {name: outcomes[name] for name, _ in tests}
+    if junit_xml:
+        write_junit_xml(junit_xml, suite_name, outcomes)
+
+    return {name: outcome.passed for name, outcome in outcomes.items()}
+
+
+def print_summary(results: Dict[str, Optional[bool]]) -> bool:
+    """Print the PASS/FAIL/SKIP table of run_tests() results; True if nothing failed"""
+    print("\n" + "=" * 50)
+    print("📊 Test Summary:")
+
+    passed = sum(result is True for result in results.values())
+    skipped = sum(result is None for result in results.values())
+
+    for test_name, result in results.items():
+        status = "⏭ SKIP" if result is None else "✅ PASS" if result else "❌ FAIL"
+        print(f"{status} {test_name}")
+
+    print(f"\nResults: {passed}/{len(results)} tests passed" + (f", {skipped} skipped" if skipped else ""))
+    return passed + skipped == len(results)
@@ -3,9 +3,18 @@ Test script for SmartMailer connections
 Tests all external services and configurations
 """
 
+import argparse
+import atexit
 import sys
 import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
 from pathlib import Path
+from typing import Dict, Tuple
+
+import pytest
 
 # Add app directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -15,199 +24,231 @@ from app.email_fetcher import EmailFetcher
 from app.email_sender import EmailSender
 from app.notifications import NotificationManager
 from app.database import DatabaseManager
+from app.email_classifier import EmailClassifier
+from app.templates import TemplateManager
+from scripts.runner import print_summary, retry_on_failure, run_tests
 from loguru import logger
 
 
+# Settings each external service needs. A check whose settings are empty is
+# skipped up front instead of waiting on a network timeout it cannot avoid.
+SERVICE_SETTINGS = {
+    'email': ('email_address', 'email_password'),
+    'telegram': ('telegram_bot_token', 'telegram_chat_id'),
+}
+
+REQUIRED_SETTINGS = [name for names in SERVICE_SETTINGS.values() for name in names]
+
+MISSING_SETTINGS = [
+    name for name, value in zip(REQUIRED_SETTINGS, attrgetter(*REQUIRED_SETTINGS)(settings))
+    if not value
+]
+
+
+def requires_settings(service: str):
+    """Skip the decorated check when any setting of the service is empty"""
+    missing = [name for name in SERVICE_SETTINGS[service] if name in MISSING_SETTINGS]
+    return pytest.mark.skipif(bool(missing), reason=f"Missing settings: {', '.join(missing)}")
+
+
+# Shared instances: each is built once, however many tests use it
+
+@lru_cache(maxsize=None)
+def _classifier() -> EmailClassifier:
+    return EmailClassifier()
+
+
+@lru_cache(maxsize=None)
+def _template_manager() -> TemplateManager:
+    return TemplateManager()
+
+
+@lru_cache(maxsize=None)
+def _database() -> DatabaseManager:
+    return DatabaseManager()
+
+
+# Connected IMAP sessions keyed by (server, account): TLS and LOGIN are paid
+# once, and a session that dropped is replaced on the next request
+_imap_pool: Dict[Tuple[str, str], EmailFetcher] = {}
+_imap_pool_lock = threading.Lock()
+
+
+def get_fetcher() -> EmailFetcher:
+    """Get a connected fetcher from the pool; raises the connection error if the server is unreachable"""
+    key = (settings.email_imap_server, settings.email_address)
+    with _imap_pool_lock:
+        fetcher = _imap_pool.get(key)
+        if fetcher is None or not fetcher.connected:
+            fetcher = EmailFetcher()
+            if not fetcher.connect():
+                _imap_pool.pop(key, None)
+                raise fetcher.last_error
+            _imap_pool[key] = fetcher
+        return fetcher
+
+
+@lru_cache(maxsize=None)
+def get_sender() -> EmailSender:
+    """Get the shared sender; its SMTP session stays open for later sends"""
+    return EmailSender()
+
+
+@lru_cache(maxsize=None)
+def get_notifier() -> NotificationManager:
+    """Get the shared notifier; getMe and sendMessage share its keep-alive session"""
+    return NotificationManager()
+
+
+@atexit.register
+def _close_pool():
+    """Log out of every pooled IMAP and SMTP session, close the other shared clients"""
+    with _imap_pool_lock:
+        for fetcher in _imap_pool.values():
+            fetcher.disconnect()
+        _imap_pool.clear()
+    
+    if get_sender.cache_info().currsize:
+        get_sender().close()
+    
+    if get_notifier.cache_info().currsize:
+        get_notifier().close()
+    
+    if _database.cache_info().currsize:
+        _database().close()
+
+
 def test_configuration():
     """Test configuration loading"""
-    print("🔧 Testing configuration...")
+    print("\n🔧 Testing configuration...")
+    
+    print(f"✓ App name: {settings.app_name}")
+    print(f"✓ App version: {settings.app_version}")
+    print(f"✓ Email provider: {settings.email_provider}")
+    print(f"✓ Check interval: {settings.check_interval_minutes} minutes")
+    print(f"✓ Auto-reply enabled: {settings.auto_reply_enabled}")
     
-    try:
-        print(f"✓ App name: {settings.app_name}")
-        print(f"✓ App version: {settings.app_version}")
-        print(f"✓ Email provider: {settings.email_provider}")
-        print(f"✓ Check interval: {settings.check_interval_minutes} minutes")
-        print(f"✓ Auto-reply enabled: {settings.auto_reply_enabled}")
-        
-        # Check required settings
-        required_settings = [
-            'email_address', 'email_password', 
-            'telegram_bot_token', 'telegram_chat_id'
-        ]
-        
-        missing_settings = []
-        for setting in required_settings:
-            if not getattr(settings, setting, None):
-                missing_settings.append(setting)
-        
-        if missing_settings:
-            print(f"⚠ Missing required settings: {', '.join(missing_settings)}")
-            return False
-        else:
-            print("✓ All required settings present")
-            return True
-            
-    except Exception as e:
-        print(f"✗ Configuration error: {e}")
-        return False
+    assert not MISSING_SETTINGS, f"Missing required settings: {', '.join(MISSING_SETTINGS)}"
+    print("✓ All required settings present")
 
 
+@pytest.mark.serial
+@pytest.mark.xdist_group("serial")
 def test_database():
     """Test database connection"""
     print("\n🗄️ Testing database...")
     
-    try:
-        db = DatabaseManager()
-        stats = db.get_processing_stats()
-        print("✓ Database connection successful")
-        print(f"✓ Total emails: {stats.get('total_emails', 0)}")
-        db.close()
-        return True
-        
-    except Exception as e:
-        print(f"✗ Database error: {e}")
-        return False
+    db = _database()
+    stats = db.get_processing_stats()
+    assert 'total_emails' in stats, "Database query failed"
+    print("✓ Database connection successful")
+    print(f"✓ Total emails: {stats.get('total_emails', 0)}")
 
 
+@pytest.mark.serial
+@pytest.mark.xdist_group("serial")
+@requires_settings('email')
+@retry_on_failure()
 def test_email_connection():
     """Test email IMAP connection"""
     print("\n📧 Testing email connection...")
     
-    try:
-        fetcher = EmailFetcher()
-        if fetcher.connect():
-            unread_count = fetcher.get_unread_count()
-            print("✓ Email IMAP connection successful")
-            print(f"✓ Unread emails: {unread_count}")
-            fetcher.disconnect()
-            return True
-        else:
-            print("✗ Email IMAP connection failed")
-            return False
-            
-    except Exception as e:
-        print(f"✗ Email connection error: {e}")
-        return False
+    # Connection errors propagate with their type: network ones are retried,
+    # a rejected login fails at once
+    fetcher = get_fetcher()
+    
+    unread_count = fetcher.get_unread_count()
+    print("✓ Email IMAP connection successful")
+    print(f"✓ Unread emails: {unread_count}")
 
 
+@requires_settings('email')
+@retry_on_failure()
 def test_smtp_connection():
     """Test SMTP connection"""
     print("\n📤 Testing SMTP connection...")
     
-    try:
-        sender = EmailSender()
-        if sender.test_connection():
-            print("✓ SMTP connection successful")
-            return True
-        else:
-            print("✗ SMTP connection failed")
-            return False
-            
-    except Exception as e:
-        print(f"✗ SMTP error: {e}")
-        return False
+    sender = get_sender()
+    if not sender.test_connection():
+        raise sender.last_error
+    print("✓ SMTP connection successful")
 
 
+@requires_settings('telegram')
 def test_telegram():
     """Test Telegram connection"""
     print("\n📱 Testing Telegram...")
     
-    try:
-        notifier = NotificationManager()
-        results = notifier.test_all_notifications()
-        
-        if results.get('telegram_connection'):
-            print("✓ Telegram bot connection successful")
-            if results.get('telegram_message'):
-                print("✓ Test message sent successfully")
-                return True
-            else:
-                print("⚠ Bot connected but test message failed")
-                return False
-        else:
-            print("✗ Telegram bot connection failed")
-            return False
-            
-    except Exception as e:
-        print(f"✗ Telegram error: {e}")
-        return False
+    results = get_notifier().test_all_notifications()
+    
+    assert results.get('telegram_connection'), "Telegram bot connection failed"
+    print("✓ Telegram bot connection successful")
+    
+    assert results.get('telegram_message'), "Bot connected but test message failed"
+    print("✓ Test message sent successfully")
 
 
 def test_classification():
     """Test email classification"""
     print("\n🤖 Testing email classification...")
     
-    try:
-        from app.email_classifier import EmailClassifier
-        
-        classifier = EmailClassifier()
-        
-        # Test important email
-        important_email = {
-            'subject': 'URGENT: Entretien demain matin',
-            'sender': 'hr@company.com',
-            'content': 'Nous avons un entretien urgent demain matin à 9h.'
-        }
-        
-        classification = classifier.classify_email(important_email)
-        print(f"✓ Important email classified as: {classification}")
-        
-        # Test normal email
-        normal_email = {
-            'subject': 'Newsletter hebdomadaire',
-            'sender': 'newsletter@example.com',
-            'content': 'Découvrez nos dernières offres promotionnelles.'
-        }
-        
-        classification = classifier.classify_email(normal_email)
-        print(f"✓ Normal email classified as: {classification}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"✗ Classification error: {e}")
-        return False
+    classifier = _classifier()
+    
+    # Important email sample
+    important_email = {
+        'subject': 'URGENT: Entretien demain matin',
+        'sender': 'hr@company.com',
+        'content': 'Nous avons un entretien urgent demain matin à 9h.'
+    }
+    
+    # Normal email sample
+    normal_email = {
+        'subject': 'Newsletter hebdomadaire',
+        'sender': 'newsletter@example.com',
+        'content': 'Découvrez nos dernières offres promotionnelles.'
+    }
+    
+    # Both samples go through the classifier in one batch call
+    important, normal = classifier.classify_batch([important_email, normal_email])
+    
+    assert important == 'important', f"Important email classified as: {important}"
+    print(f"✓ Important email classified as: {important}")
+    
+    assert normal == 'normal', f"Normal email classified as: {normal}"
+    print(f"✓ Normal email classified as: {normal}")
 
 
 def test_templates():
     """Test template rendering"""
     print("\n📝 Testing templates...")
     
-    try:
-        from app.templates import TemplateManager
-        
-        template_manager = TemplateManager()
-        
-        # Test auto-reply template
-        test_email = {
-            'subject': 'Test email',
-            'date_received': '2024-01-01 10:00:00'
-        }
-        
-        auto_reply = template_manager.render_auto_reply(test_email)
-        if auto_reply and 'Merci pour votre message' in auto_reply:
-            print("✓ Auto-reply template rendering successful")
-        else:
-            print("✗ Auto-reply template rendering failed")
-            return False
-        
-        # Test notification template
-        notification = template_manager.render_notification(test_email)
-        if notification and 'Email Important Reçu' in notification:
-            print("✓ Notification template rendering successful")
-        else:
-            print("✗ Notification template rendering failed")
-            return False
-        
-        return True
-        
-    except Exception as e:
-        print(f"✗ Template error: {e}")
-        return False
+    template_manager = _template_manager()
+    
+    # Test auto-reply template
+    test_email = {
+        'subject': 'Test email',
+        'date_received': datetime(2024, 1, 1, 10, 0)
+    }
+    
+    auto_reply = template_manager.render_auto_reply(test_email)
+    assert auto_reply and 'Merci pour votre message' in auto_reply, "Auto-reply template rendering failed"
+    print("✓ Auto-reply template rendering successful")
+    
+    # Test notification template
+    notification = template_manager.render_notification(test_email)
+    assert notification and 'Email Important Reçu' in notification, "Notification template rendering failed"
+    print("✓ Notification template rendering successful")
 
 
 def main():
     """Main test function"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--junitxml", metavar="PATH", help="Also write a JUnit XML report to PATH")
+    args = parser.parse_args()
+    
+    # App log records are printed inside each test's block by run_tests()
+    logger.remove()  # Remove default handler
+    
     print("🧪 SmartMailer Connection Tests")
     print("=" * 50)
     
@@ -221,31 +262,10 @@ def main():
         ("Templates", test_templates)
     ]
     
-    results = {}
-    
-    for test_name, test_func in tests:
-        try:
-            results[test_name] = test_func()
-        except Exception as e:
-            print(f"✗ {test_name} test crashed: {e}")
-            results[test_name] = False
-    
-    # Summary
-    print("\n" + "=" * 50)
-    print("📊 Test Summary:")
-    
-    passed = 0
-    total = len(results)
-    
-    for test_name, result in results.items():
-        status = "✅ PASS" if result else "❌ FAIL"
-        print(f"{status} {test_name}")
-        if result:
-            passed += 1
-    
-    print(f"\nResults: {passed}/{total} tests passed")
+    # The checks are independent: run them concurrently
+    results = run_tests(tests, junit_xml=args.junitxml, suite_name="test_connections")
     
-    if passed == total:
+    if print_summary(results):
         print("🎉 All tests passed! SmartMailer is ready to use.")
         return 0
     else: